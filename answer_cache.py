@@ -0,0 +1,173 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import itertools
+import re
+import threading
+import time
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Questions about the asker themselves ("can I take...", "my dose") are answered
+# against their profile, so they are only shared between matching profiles.
+PERSONAL_PATTERN = re.compile(
+    r"\b(i|i'm|im|me|my|mine|myself|dose|dosage|how much|how many|safe for|pregnan\w*)\b",
+    re.IGNORECASE
+)
+
+# Follow-ups only make sense with the conversation before them: connective
+# openers, and pronouns or back-references anywhere that point at something
+# said earlier. Anything else is taken as standalone, so callers answer and
+# cache it from a prompt without the conversation. Erring towards follow-up
+# only costs a cache miss.
+FOLLOW_UP_PATTERN = re.compile(
+    r"^\s*(and|also|so|then|but|or|ok|okay|what about|how about|why)\b"
+    r"|\b(it|its|it's|itself|that|this|those|these|they|them|their|theirs|he|she|him|his|"
+    r"her|hers|the same|same thing|the other|the first|the second|the last|the one|"
+    r"you said|you mentioned|as well|instead|else|again)\b",
+    re.IGNORECASE
+)
+
+
+def scope_for(query: str, user: Dict) -> Optional[Tuple]:
+    """Cache partition for ``query`` asked by ``user``, or None if uncacheable."""
+    if FOLLOW_UP_PATTERN.search(query):
+        return None
+    if not PERSONAL_PATTERN.search(query):
+        return ('global',)
+    age = user.get('age')
+    age_band = (age // 10) * 10 if isinstance(age, int) else None
+    history = ' '.join(str(user.get('medical_history') or 'none').lower().split())
+    return ('profile', age_band, history)
+
+
+class _Entry:
+    __slots__ = ('query', 'answer', 'vector', 'scope', 'expires_at', 'latency', 'last_hit')
+
+    def __init__(self, query, answer, vector, scope, expires_at, latency):
+        self.query = query
+        self.answer = answer
+        self.vector = vector
+        self.scope = scope
+        self.expires_at = expires_at
+        self.latency = latency
+        self.last_hit = time.monotonic()
+
+
+class SemanticAnswerCache:
+    """Reuses LLM answers for questions whose embeddings are close enough.
+
+    ``embed`` is typically ``RAGSystem.get_embedding``. A lookup only
+    considers entries in the same scope (see ``scope_for``) whose cosine
+    similarity is at least ``threshold``. Cached answers must come from a
+    prompt without the conversation, and answers for the ``('global',)``
+    scope, served to everyone, also without the asker's profile.
+    """
+
+    def __init__(self, embed: Callable[[str], List[float]], threshold: float = 0.92,
+                 ttl: float = 6 * 3600, max_entries: int = 5000):
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+        self._entries: Dict[int, _Entry] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _vector(self, text: str) -> Optional[np.ndarray]:
+        vector = np.asarray(self.embed(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if vector.size == 0 or norm == 0:
+            return None
+        return vector / norm
+
+    def _best(self, vector: np.ndarray, scope: Tuple) -> Tuple[Optional[int], float]:
+        now = time.monotonic()
+        candidates = [(entry_id, e) for entry_id, e in self._entries.items()
+                      if e.scope == scope and e.expires_at > now]
+        if not candidates:
+            return None, 0.0
+        scores = np.stack([e.vector for _, e in candidates]) @ vector
+        best = int(np.argmax(scores))
+        return candidates[best][0], float(scores[best])
+
+    def lookup(self, query: str, user: Dict) -> Optional[str]:
+        scope = scope_for(query, user)
+        if scope is None:
+            return None
+        vector = self._vector(query)
+        if vector is None:
+            return None
+        with self._lock:
+            entry_id, score = self._best(vector, scope)
+            if entry_id is None or score < self.threshold:
+                self.misses += 1
+                return None
+            entry = self._entries[entry_id]
+            entry.last_hit = time.monotonic()
+            self.hits += 1
+            self.latency_saved += entry.latency
+            logger.info(f"Answer cache hit {entry_id} (similarity {score:.3f})")
+            return entry.answer
+
+    def store(self, query: str, user: Dict, answer: str, latency: float = 0.0) -> Optional[int]:
+        """Cache ``answer`` and return its entry id, or None if it was not cached."""
+        name = user.get('name')
+        if name and str(name).lower() in answer.lower():
+            # Personalised wording must not be served to anyone else.
+            return None
+        scope = scope_for(query, user)
+        if scope is None:
+            return None
+        vector = self._vector(query)
+        if vector is None:
+            return None
+        with self._lock:
+            self._evict()
+            entry_id = next(self._ids)
+            self._entries[entry_id] = _Entry(query, answer, vector, scope,
+                                             time.monotonic() + self.ttl, latency)
+            return entry_id
+
+    def _evict(self):
+        now = time.monotonic()
+        for entry_id in [i for i, e in self._entries.items() if e.expires_at <= now]:
+            del self._entries[entry_id]
+        while len(self._entries) >= self.max_entries:
+            oldest = min(self._entries, key=lambda i: self._entries[i].last_hit)
+            del self._entries[oldest]
+
+    def invalidate(self, entry_id: int) -> bool:
+        with self._lock:
+            return self._entries.pop(entry_id, None) is not None
+
+    def invalidate_query(self, query: str, threshold: Optional[float] = None) -> int:
+        """Drop every entry, in any scope, similar to ``query``. Returns the count."""
+        vector = self._vector(query)
+        if vector is None:
+            return 0
+        threshold = self.threshold if threshold is None else threshold
+        with self._lock:
+            doomed = [i for i, e in self._entries.items() if float(e.vector @ vector) >= threshold]
+            for entry_id in doomed:
+                del self._entries[entry_id]
+            return len(doomed)
+
+    def entries(self) -> List[Dict]:
+        with self._lock:
+            return [{'id': i, 'query': e.query, 'scope': e.scope} for i, e in self._entries.items()]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'latency_saved': self.latency_saved
+            }
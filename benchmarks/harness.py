@@ -0,0 +1,405 @@
+"""Replay WhatsApp conversations against the bot and report latency per scenario.
+
+Runs the Flask app in-process on an in-memory MongoDB stand-in, with a stub
+LLM server and a stub embedding model, so nothing talks to Atlas, Perplexity
+or Twilio:
+
+    pip install mongomock
+    python -m benchmarks.harness --llm-latency 0.3 --concurrency 16 --copies 8
+    python -m benchmarks.harness --save-baseline benchmarks/baseline.json
+    python -m benchmarks.harness --baseline benchmarks/baseline.json   # exits 1 on regression
+
+With ``--repeat N`` (default 3) the replay runs N times, each in a fresh
+process, and the report holds the median of each latency and throughput
+figure and the largest error count; single runs are too noisy to gate on.
+``benchmarks/baseline.json`` is a reference report with the default options;
+its ``config`` and ``python`` keys record how it was made. Re-record it on
+the machine that runs the comparison, since absolute timings do not transfer.
+
+Each line of the conversations file is one JSON object with a ``scenario``:
+
+    {"scenario": "onboarding", "messages": ["hi", "hi", "Sam", "34", "none"]}
+    {"scenario": "chat", "messages": ["I have a headache", "Is ibuprofen safe?"]}
+    {"scenario": "handoff", "priority": "HIGH"}
+    {"scenario": "ingestion", "documents": ["Flu symptoms include ...", "..."]}
+    {"scenario": "rag_search", "query": "what helps with a fever"}
+
+Conversations may carry a ``from`` number; otherwise one is generated. Chat
+users are onboarded (untimed) before their messages are replayed. Messages
+within a conversation are sent in order; conversations run concurrently.
+``--export-chats`` writes recorded chats from a MongoDB ``chats`` collection
+in this format, with phone numbers dropped.
+
+mongomock is not thread-safe, so the harness serializes every call on it
+(see ``stubs.serialized_mongomock``), which also flattens database
+contention; pass ``--mongodb-uri`` pointing at a throwaway local mongod to
+measure that too.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.stubs import StubEmbeddingModel, StubServer, serialized_mongomock
+from benchmarks.worker_concurrency import ONBOARDING
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CONVERSATIONS = os.path.join(ROOT, 'benchmarks', 'conversations.jsonl')
+
+# Ingestion runs before search so there is a corpus to search
+SCENARIOS = ('onboarding', 'chat', 'handoff', 'ingestion', 'rag_search')
+
+# Ignore smaller changes: millisecond-scale tails and throughput of
+# in-process requests swing by this much with thread scheduling alone, even
+# as the median of a few runs (handoff, a fraction of a second of work,
+# moves by ~70 req/s)
+MIN_P95_DELTA = 0.05
+MIN_RPS_DELTA = 100.0
+
+
+def load_conversations(path: str, copies: int = 1) -> Dict[str, List[Dict]]:
+    """Read the conversations file, repeating each line ``copies`` times."""
+    scenarios = {name: [] for name in SCENARIOS}
+    with open(path) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    n = 0
+    for copy in range(copies):
+        for line in lines:
+            scenario = line.get('scenario')
+            if scenario not in scenarios:
+                raise ValueError(f"Unknown scenario {scenario!r} in {path}")
+            item = dict(line)
+            # Every replayed conversation is a distinct user
+            item['from'] = f"{line['from']}{copy:03d}" if line.get('from') else f"+1555{n:07d}"
+            if scenario == 'ingestion' and copy:
+                # Keep copies distinct so they are not skipped as already ingested
+                item['documents'] = [f"{doc} [{copy}]" for doc in line['documents']]
+            scenarios[scenario].append(item)
+            n += 1
+    return scenarios
+
+
+def export_conversations(collection, path: str, limit: int = 1000, min_turns: int = 2) -> int:
+    """Write recorded chats as ``chat`` conversations, one per user."""
+    by_user: Dict[str, List[str]] = {}
+    for chat in collection.find({}, {'phone_number': 1, 'message': 1}).sort('timestamp', 1):
+        by_user.setdefault(chat['phone_number'], []).append(chat['message'])
+    written = 0
+    with open(path, 'w') as f:
+        for messages in by_user.values():
+            if len(messages) < min_turns:
+                continue
+            f.write(json.dumps({'scenario': 'chat', 'messages': messages}) + '\n')
+            written += 1
+            if written >= limit:
+                break
+    return written
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of sorted ``values``."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(p * len(values)) - 1))]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    latencies = sorted(latencies)
+    return {
+        'ops': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else 0.0
+    }
+
+
+class Harness:
+    """Drives one scenario at a time against the in-process app."""
+
+    def __init__(self, args, stub_url: str, workdir: str):
+        os.environ.update({
+            'MONGODB_URI': args.mongodb_uri,
+            'PERPLEXITY_BASE_URL': stub_url,
+            'PERPLEXITY_API_KEY': 'bench',
+            'TWILIO_API_BASE': stub_url,
+            'LLM_MAX_CONCURRENCY': str(args.concurrency * 2),
+            'CHAT_LOG_SPILL': os.path.join(workdir, 'chat_spill.jsonl'),
+            'ASYNC_REPLIES': '0'
+        })
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        sys.path.insert(0, ROOT)
+
+        import model_registry
+        if not args.real_embeddings:
+            model_registry.register_model(
+                model_registry.MODEL_NAME,
+                StubEmbeddingModel(args.dim, latency=args.embedding_latency)
+            )
+
+        import app
+        if args.mongodb_uri.startswith('mongomock://'):
+            app.connect_mongo = serialized_mongomock
+        from handoff import HandoffHandler
+        from models import Agent, AgentStatus
+        from rag import RAGSystem
+        from vector_index import VectorIndex
+
+        self.app = app
+        self.concurrency = args.concurrency
+        app.init_services()
+
+        self.handoffs = HandoffHandler(app.db['users'], app.db['handoffs'], app.db['agents'])
+        for n in range(args.agents):
+            agent = Agent(f"bench-agent-{n}", f"Agent {n}", capacity=args.concurrency)
+            agent.status = AgentStatus.AVAILABLE
+            self.handoffs.register_agent(agent)
+
+        index = None
+        if args.rag_backend == 'index':
+            index = VectorIndex(os.path.join(workdir, 'documents'), dim=args.dim,
+                                sync_interval=0)
+        self.rag = RAGSystem(app.db['documents'], index=index,
+                             storage_format='int8' if args.rag_backend == 'scan' else 'float32')
+
+    def close(self):
+        self.app.shutdown_services()
+
+    def _post(self, client, phone: str, body: str, seq) -> bool:
+        response = client.post('/', data={
+            'From': f"whatsapp:{phone}",
+            'Body': body,
+            'MessageSid': f"SMbench{phone}-{seq}"
+        })
+        return response.status_code == 200
+
+    def _onboard(self, item: Dict):
+        client = self.app.app.test_client()
+        for n, body in enumerate(ONBOARDING):
+            self._post(client, item['from'], body, f"onboard{n}")
+
+    def _conversation(self, item: Dict) -> Tuple[List[float], int]:
+        client = self.app.app.test_client()
+        phone = item['from']
+        latencies, errors = [], 0
+        for n, body in enumerate(item['messages']):
+            start = time.perf_counter()
+            ok = self._post(client, phone, body, n)
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+        return latencies, errors
+
+    def _handoff(self, item: Dict) -> Tuple[List[float], int]:
+        from models import HandoffPriority
+        priority = HandoffPriority[item.get('priority', 'NORMAL').upper()]
+        start = time.perf_counter()
+        ok = self.handoffs.request_handoff(item['from'], priority)
+        assigned = self.handoffs.auto_assign(max_assignments=1) if ok else []
+        ok = ok and bool(assigned) and self.handoffs.complete_handoff(assigned[0]['_id'])
+        return [time.perf_counter() - start], int(not ok)
+
+    def _ingestion(self, item: Dict) -> Tuple[List[float], int]:
+        start = time.perf_counter()
+        stats = self.rag.add_documents(item['documents'], chunk_words=item.get('chunk_words'))
+        ok = stats['chunks'] == stats['inserted'] + stats['skipped']
+        return [time.perf_counter() - start], int(not ok)
+
+    def _rag_search(self, item: Dict) -> Tuple[List[float], int]:
+        start = time.perf_counter()
+        results = self.rag.search(item['query'], item.get('limit', 5))
+        return [time.perf_counter() - start], int(not results)
+
+    def run(self, scenario: str, items: List[Dict]) -> Optional[Dict]:
+        if not items:
+            return None
+        job = (self._conversation if scenario in ('onboarding', 'chat')
+               else getattr(self, f"_{scenario}"))
+        latencies, errors = [], 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            if scenario == 'chat':
+                list(pool.map(self._onboard, items))
+            start = time.perf_counter()
+            for item_latencies, item_errors in pool.map(job, items):
+                latencies.extend(item_latencies)
+                errors += item_errors
+        elapsed = time.perf_counter() - start
+        return summarize(latencies, errors, elapsed)
+
+
+HEADER = (f"{'scenario':<12} {'ops':>6} {'err':>4} {'req/s':>8} "
+          f"{'p50 s':>8} {'p95 s':>8} {'p99 s':>8}")
+
+
+def print_row(scenario: str, row: Dict):
+    print(f"{scenario:<12} {row['ops']:>6} {row['errors']:>4} {row['rps']:>8.1f} "
+          f"{row['p50']:>8.4f} {row['p95']:>8.4f} {row['p99']:>8.4f}")
+
+
+def run_scenarios(args, scenarios: Dict[str, List[Dict]], selected) -> Dict[str, Dict]:
+    """One replay of the selected scenarios in this process."""
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir, \
+            StubServer(llm_latency=args.llm_latency) as stub:
+        harness = Harness(args, stub.url, workdir)
+        try:
+            print(HEADER)
+            for scenario in SCENARIOS:
+                if scenario not in selected:
+                    continue
+                row = harness.run(scenario, scenarios[scenario])
+                if row is None:
+                    print(f"{scenario:<12} skipped (no conversations)")
+                    continue
+                results[scenario] = row
+                print_row(scenario, row)
+        finally:
+            harness.close()
+    return results
+
+
+def _child_argv(args) -> List[str]:
+    argv = [args.conversations, '--repeat', '1',
+            '--copies', str(args.copies), '--concurrency', str(args.concurrency),
+            '--llm-latency', str(args.llm_latency),
+            '--embedding-latency', str(args.embedding_latency),
+            '--dim', str(args.dim), '--rag-backend', args.rag_backend,
+            '--agents', str(args.agents), '--mongodb-uri', args.mongodb_uri]
+    for scenario in args.scenario or ():
+        argv += ['--scenario', scenario]
+    if args.real_embeddings:
+        argv.append('--real-embeddings')
+    return argv
+
+
+def run_repeated(args) -> List[Dict[str, Dict]]:
+    """``args.repeat`` replays, each in a fresh process so no state carries over."""
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in range(args.repeat):
+            path = os.path.join(tmp, f"run{n}.json")
+            print(f"run {n + 1}/{args.repeat}", file=sys.stderr)
+            subprocess.run([sys.executable, '-m', 'benchmarks.harness', *_child_argv(args),
+                            '--output', path], cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+            with open(path) as f:
+                runs.append(json.load(f)['scenarios'])
+    return runs
+
+
+def median_report(runs: List[Dict[str, Dict]]) -> Dict[str, Dict]:
+    """Per scenario, the median of each figure across ``runs`` and the most errors."""
+    merged = {}
+    for scenario in runs[0]:
+        rows = [run[scenario] for run in runs if scenario in run]
+        merged[scenario] = {key: statistics.median(row[key] for row in rows)
+                            for key in ('rps', 'p50', 'p95', 'p99', 'max')}
+        merged[scenario]['ops'] = rows[0]['ops']
+        merged[scenario]['errors'] = max(row['errors'] for row in rows)
+    return merged
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Regressions of ``report`` against ``baseline`` beyond ``tolerance``."""
+    regressions = []
+    if report['config'] != baseline.get('config'):
+        print(f"warning: baseline was recorded with {baseline.get('config')}", file=sys.stderr)
+    for scenario, current in report['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(scenario)
+        if base is None:
+            continue
+        if (current['p95'] > base['p95'] * (1 + tolerance)
+                and current['p95'] - base['p95'] > MIN_P95_DELTA):
+            regressions.append(f"{scenario}: p95 {base['p95']:.4f}s -> {current['p95']:.4f}s")
+        if (current['rps'] < base['rps'] * (1 - tolerance)
+                and base['rps'] - current['rps'] > MIN_RPS_DELTA):
+            regressions.append(f"{scenario}: req/s {base['rps']:.1f} -> {current['rps']:.1f}")
+        if current['errors'] > base['errors']:
+            regressions.append(f"{scenario}: errors {base['errors']} -> {current['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay conversations and report latency')
+    parser.add_argument('conversations', nargs='?', default=DEFAULT_CONVERSATIONS)
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='run only these scenarios (repeatable)')
+    parser.add_argument('--copies', type=int, default=16,
+                        help='replay each conversation this many times as distinct users')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='replay this many times in fresh processes and report medians')
+    parser.add_argument('--llm-latency', type=float, default=0.2)
+    parser.add_argument('--embedding-latency', type=float, default=0.0)
+    parser.add_argument('--real-embeddings', action='store_true',
+                        help='load the real embedding model instead of the stub')
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--rag-backend', choices=('index', 'scan'), default='index')
+    parser.add_argument('--agents', type=int, default=4)
+    parser.add_argument('--mongodb-uri', default='mongomock://',
+                        help='e.g. mongodb://localhost:27017 for a throwaway local mongod')
+    parser.add_argument('--output', help='write the report as JSON')
+    parser.add_argument('--save-baseline', help='write the report as the new baseline')
+    parser.add_argument('--baseline', help='compare against this baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--export-chats', metavar='URI',
+                        help='write recorded chats from MongoDB at URI to CONVERSATIONS and exit')
+    parser.add_argument('--db', default='healthcare_bot')
+    args = parser.parse_args()
+
+    if args.export_chats:
+        from pymongo import MongoClient
+        client = MongoClient(args.export_chats)
+        written = export_conversations(client[args.db]['chats'], args.conversations)
+        print(f"Wrote {written} conversations to {args.conversations}")
+        return
+
+    scenarios = load_conversations(args.conversations, args.copies)
+    selected = args.scenario or SCENARIOS
+    config = {
+        'conversations': os.path.basename(args.conversations),
+        'copies': args.copies,
+        'concurrency': args.concurrency,
+        'llm_latency': args.llm_latency,
+        'embedding_latency': args.embedding_latency,
+        'real_embeddings': args.real_embeddings,
+        'rag_backend': args.rag_backend,
+        'mongodb': args.mongodb_uri.split('://')[0],
+        'repeat': args.repeat
+    }
+    report = {'config': config, 'python': platform.python_version(), 'scenarios': {}}
+
+    if args.repeat > 1:
+        report['scenarios'] = median_report(run_repeated(args))
+        print(f"median of {args.repeat} runs")
+        print(HEADER)
+        for scenario, row in report['scenarios'].items():
+            print_row(scenario, row)
+    else:
+        report['scenarios'] = run_scenarios(args, scenarios, selected)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+                f.write('\n')
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
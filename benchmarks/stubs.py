@@ -0,0 +1,175 @@
+"""Local stand-ins for the external services the bot talks to."""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import threading
+import time
+import urllib.parse
+import zlib
+
+import numpy as np
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        if self.path.endswith('/chat/completions'):
+            time.sleep(server.llm_latency)
+            with server.lock:
+                status = server.llm_statuses.pop(0) if server.llm_statuses else 200
+            if status != 200:
+                self._reply(status, {'error': f"stub status {status}"})
+                return
+            payload = json.loads(body or b'{}')
+            prompt = payload.get('messages', [{}])[-1].get('content', '')
+            self._reply(200, {
+                'choices': [{'message': {'content': f"Stub answer to: {prompt[:80]}"}}],
+                'usage': {'prompt_tokens': len(prompt) // 4 + 1, 'completion_tokens': 20}
+            })
+        elif self.path.endswith('/Messages.json'):
+            form = urllib.parse.parse_qs(body.decode('utf-8'))
+            with server.lock:
+                server.sent_messages += 1
+                server.messages.append({key: values[0] for key, values in form.items()})
+            self._reply(201, {'sid': f"SM{server.sent_messages:032d}", 'status': 'queued'})
+        else:
+            self._reply(404, {'error': 'not found'})
+
+
+class StubServer(ThreadingHTTPServer):
+    """Serves ``/chat/completions`` (Perplexity) and ``/.../Messages.json``
+    (Twilio REST) on localhost, with a configurable LLM delay. Sent Twilio
+    messages are kept, in arrival order, as form dicts in ``messages``.
+    Statuses appended to ``llm_statuses`` answer the next LLM calls, one
+    each, before it goes back to 200."""
+
+    daemon_threads = True
+
+    def __init__(self, llm_latency: float = 0.2, port: int = 0):
+        super().__init__(('127.0.0.1', port), _StubHandler)
+        self.llm_latency = llm_latency
+        self.requests = 0
+        self.sent_messages = 0
+        self.messages = []
+        self.llm_statuses = []
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class StubEmbeddingModel:
+    """Deterministic stand-in for a SentenceTransformer.
+
+    A text embeds as the normalised sum of one fixed random vector per word,
+    so texts sharing words score as similar. ``latency`` is slept once per
+    ``encode`` call to mimic model time.
+    """
+
+    def __init__(self, dim: int = 768, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self._words = {}
+        self._lock = threading.Lock()
+
+    def _word(self, word: str) -> np.ndarray:
+        with self._lock:
+            vector = self._words.get(word)
+            if vector is None:
+                rng = np.random.default_rng(zlib.crc32(word.encode('utf-8')))
+                vector = self._words[word] = rng.standard_normal(self.dim).astype(np.float32)
+            return vector
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r'\w+', text.lower()):
+            vector += self._word(word)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_tensor: bool = False, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        if isinstance(sentences, str):
+            return self._embed(sentences)
+        return np.stack([self._embed(s) for s in sentences]) if sentences else np.empty((0, self.dim))
+
+
+class _Serialized:
+    """Proxy running every call on a mongomock object under one shared lock.
+
+    Databases, collections and cursors it hands out are wrapped the same way;
+    iterating a cursor reads all of it under the lock.
+    """
+
+    def __init__(self, target, lock):
+        self._target = target
+        self._lock = lock
+
+    def _wrap(self, value):
+        import mongomock
+        from mongomock.collection import Cursor
+        from mongomock.command_cursor import CommandCursor
+        if isinstance(value, (mongomock.Database, mongomock.Collection, Cursor, CommandCursor)):
+            return _Serialized(value, self._lock)
+        return value
+
+    def __getattr__(self, name):
+        with self._lock:
+            value = self._wrap(getattr(self._target, name))
+        # Collections are callable too, so check for a wrapped object first
+        if isinstance(value, _Serialized) or not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            with self._lock:
+                return self._wrap(value(*args, **kwargs))
+        return call
+
+    def __getitem__(self, name):
+        with self._lock:
+            return self._wrap(self._target[name])
+
+    def __iter__(self):
+        with self._lock:
+            items = list(self._target)
+        return iter(items)
+
+
+def serialized_mongomock():
+    """A mongomock client safe to share between threads.
+
+    mongomock is not thread-safe: concurrent writes corrupt its in-memory
+    collections (e.g. "OrderedDict mutated during iteration"). Serializing
+    every call keeps benchmark error counts meaningful.
+    """
+    import mongomock
+    return _Serialized(mongomock.MongoClient(), threading.RLock())
@@ -0,0 +1,127 @@
+"""Compare concurrent webhook throughput per gunicorn worker class.
+
+Starts one gunicorn worker per configuration against a stub LLM with a
+fixed delay and an in-process MongoDB stand-in, then fires chat messages
+at it concurrently:
+
+    pip install mongomock          # plus gevent for the gevent row
+    python -m benchmarks.worker_concurrency --llm-latency 0.5 --concurrency 16
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import importlib.util
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmarks.stubs import StubServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIGS = [
+    # gunicorn turns sync into gthread when threads > 1
+    ('sync', {'GUNICORN_WORKER_CLASS': 'sync', 'GUNICORN_THREADS': '1'}),
+    ('gthread x8', {'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '8'}),
+    ('gthread x32', {'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '32'}),
+    ('gevent', {'GUNICORN_WORKER_CLASS': 'gevent'}),
+]
+
+# A new user's first two messages both get a prompt before the name is asked
+ONBOARDING = ['hi', 'hi', 'Sam', '34', 'none']
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_up(url: str, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f"gunicorn did not start at {url}")
+
+
+def _post(url: str, phone: str, body: str) -> float:
+    start = time.perf_counter()
+    response = requests.post(url, data={'From': f"whatsapp:{phone}", 'Body': body}, timeout=120)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+def run_config(name: str, extra_env: dict, stub_url: str, args) -> dict:
+    port = _free_port()
+    env = {
+        **os.environ,
+        **extra_env,
+        'PORT': str(port),
+        'WEB_CONCURRENCY': '1',
+        'MONGODB_URI': 'mongomock://',
+        'PERPLEXITY_BASE_URL': stub_url,
+        'PERPLEXITY_API_KEY': 'bench',
+        'LLM_MAX_CONCURRENCY': str(args.concurrency * 2),
+    }
+    workdir = tempfile.TemporaryDirectory()
+    env['CHAT_LOG_SPILL'] = os.path.join(workdir.name, 'chat_spill.jsonl')
+    log = open(os.path.join(workdir.name, 'gunicorn.log'), 'w')
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app'], cwd=ROOT, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}/"
+    try:
+        _wait_until_up(url)
+        phones = [f"+1555{n:07d}" for n in range(args.users)]
+        for phone in phones:
+            for body in ONBOARDING:
+                _post(url, phone, body)
+
+        jobs = [(phones[n % len(phones)], f"question {n}") for n in range(args.requests)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            latencies = sorted(pool.map(lambda job: _post(url, *job), jobs))
+        elapsed = time.perf_counter() - start
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        log.close()
+        workdir.cleanup()
+    return {
+        'config': name,
+        'rps': len(latencies) / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': latencies[int(len(latencies) * 0.95) - 1],
+        'concurrent_per_worker': len(latencies) / elapsed * args.llm_latency
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent requests per gunicorn worker')
+    parser.add_argument('--llm-latency', type=float, default=0.5)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--users', type=int, default=16)
+    args = parser.parse_args()
+
+    with StubServer(llm_latency=args.llm_latency) as stub:
+        print(f"{'config':<12} {'req/s':>8} {'p50 s':>8} {'p95 s':>8} {'in-flight':>10}")
+        for name, extra_env in CONFIGS:
+            if name == 'gevent' and importlib.util.find_spec('gevent') is None:
+                print(f"{name:<12} skipped (gevent not installed)")
+                continue
+            row = run_config(name, extra_env, stub.url, args)
+            print(f"{row['config']:<12} {row['rps']:>8.1f} {row['p50']:>8.3f} "
+                  f"{row['p95']:>8.3f} {row['concurrent_per_worker']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
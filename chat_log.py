@@ -0,0 +1,121 @@
+from typing import Dict, List
+import os
+import threading
+import logging
+
+from bson import json_util
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+class ChatLogWriter:
+    """Buffers chat records and writes them with ``insert_many`` off the
+    response path.
+
+    A background thread flushes every ``flush_interval`` seconds, or as soon
+    as ``max_batch`` records are waiting. If MongoDB is unreachable the batch
+    is appended to ``spill_path`` and replayed on the next successful flush.
+    """
+
+    def __init__(self, collection, max_batch: int = 100, flush_interval: float = 1.0,
+                 spill_path: str = 'chat_spill.jsonl'):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.written = 0
+        self.spilled = 0
+        self._buffer: List[Dict] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def write(self, doc: Dict):
+        self._ensure_thread()
+        with self._lock:
+            self._buffer.append(doc)
+            full = len(self._buffer) >= self.max_batch
+        if full:
+            self._wake.set()
+
+    def pending(self, phone_number: str) -> List[Dict]:
+        """Records for ``phone_number`` not yet written to MongoDB."""
+        with self._lock:
+            return [d for d in self._buffer if d.get('phone_number') == phone_number]
+
+    def _ensure_thread(self):
+        # Threads do not survive fork; start one per process on first write.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name='chat-log-writer',
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            batch = self._load_spill() + batch
+            if not batch:
+                return
+            try:
+                self.collection.insert_many(batch, ordered=False)
+                self.written += len(batch)
+            except BulkWriteError as e:
+                # Records replayed from the spill file may already be stored.
+                errors = e.details.get('writeErrors', [])
+                failed = [batch[err['index']] for err in errors if err.get('code') != DUPLICATE_KEY]
+                self.written += len(batch) - len(errors)
+                if failed:
+                    self._spill(failed)
+            except PyMongoError as e:
+                logger.error(f"Chat log flush failed, spilling {len(batch)} records: {e}")
+                self._spill(batch)
+
+    def _spill(self, batch: List[Dict]):
+        try:
+            with open(self.spill_path, 'a') as f:
+                for doc in batch:
+                    f.write(json_util.dumps(doc) + '\n')
+            self.spilled += len(batch)
+        except OSError as e:
+            logger.error(f"Chat log spill failed, dropping {len(batch)} records: {e}")
+
+    def _load_spill(self) -> List[Dict]:
+        if not os.path.exists(self.spill_path):
+            return []
+        try:
+            replay = f"{self.spill_path}.{os.getpid()}.replay"
+            os.replace(self.spill_path, replay)
+            with open(replay) as f:
+                docs = [json_util.loads(line) for line in f if line.strip()]
+            os.remove(replay)
+            logger.info(f"Replaying {len(docs)} spilled chat records")
+            return docs
+        except (OSError, ValueError) as e:
+            logger.error(f"Chat spill replay error: {e}")
+            return []
+
+    def close(self):
+        """Stop the background thread and write out everything buffered."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=5)
+        self.flush()
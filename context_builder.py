@@ -0,0 +1,128 @@
+from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = (
+    "Update the running summary of a conversation between a patient and a "
+    "healthcare assistant. Keep symptoms, medications, advice given and open "
+    "questions. Reply with the summary only, under {words} words."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def _turn_tokens(turn: Dict) -> int:
+    return estimate_tokens(turn.get('message', '')) + estimate_tokens(turn.get('response', '')) + 8
+
+
+class ContextBuilder:
+    """Packs recent chat turns into the prompt under a token budget.
+
+    Turns that no longer fit are folded into a rolling summary stored on the
+    user document (``conversation_summary``, covering everything up to
+    ``summary_until``). A turn stays in the prompt, over budget if need be,
+    until the summary covers it, so nothing falls out of context. Once
+    ``summarize_every`` such turns have piled up the summary is refreshed
+    on a background thread, off the response path, and handed to
+    ``save_summary``. Each refresh only sends the previous summary plus the
+    uncovered turns.
+    """
+
+    def __init__(self, history: Callable[[str, int], List[Dict]],
+                 summarize: Callable[[List[Dict]], str],
+                 save_summary: Callable[[str, str, datetime], None],
+                 token_budget: int = 1500, max_turns: int = 20, summarize_every: int = 4,
+                 summary_words: int = 150, workers: int = 2):
+        self.history = history
+        self.summarize = summarize
+        self.save_summary = save_summary
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.summarize_every = summarize_every
+        self.summary_words = summary_words
+        self.workers = workers
+        self._refreshing = set()
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def build(self, user: Dict, system_prompt: str, message: str) -> Tuple[List[Dict], int]:
+        """Return ``(messages, prompt_tokens)``, scheduling a summary refresh if due."""
+        turns = self.history(user['phone_number'], self.max_turns)
+        summary = user.get('conversation_summary')
+        until = user.get('summary_until')
+        fixed = estimate_tokens(system_prompt) + estimate_tokens(message)
+        if summary:
+            fixed += estimate_tokens(summary)
+
+        packed, uncovered, used = [], [], fixed
+        for turn in turns:
+            cost = _turn_tokens(turn)
+            if used + cost > self.token_budget:
+                if until is not None and turn['timestamp'] <= until:
+                    break
+                uncovered.append(turn)
+            packed.append(turn)
+            used += cost
+        if len(uncovered) >= self.summarize_every:
+            self._refresh_later(user['phone_number'], summary, uncovered)
+
+        messages = [{"role": "system", "content": system_prompt}]
+        if summary:
+            messages[0]["content"] += f"\nEarlier in this conversation: {summary}"
+        for turn in reversed(packed):
+            messages.append({"role": "user", "content": turn['message']})
+            messages.append({"role": "assistant", "content": turn['response']})
+        messages.append({"role": "user", "content": message})
+        prompt_tokens = sum(estimate_tokens(m['content']) for m in messages)
+        return messages, prompt_tokens
+
+    def _refresh_later(self, phone_number: str, summary: Optional[str], turns: List[Dict]):
+        with self._lock:
+            if phone_number in self._refreshing:
+                return
+            self._refreshing.add(phone_number)
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix='summary')
+                self._pool_pid = os.getpid()
+            pool = self._pool
+        pool.submit(self._refresh_summary, phone_number, summary, list(reversed(turns)))
+
+    def _refresh_summary(self, phone_number: str, summary: Optional[str], turns: List[Dict]):
+        """Fold ``turns`` (oldest first) into ``summary`` and save the result."""
+        prompt = [
+            {"role": "system", "content": SUMMARY_PROMPT.format(words=self.summary_words)},
+            {"role": "user", "content": _transcript(summary, turns)}
+        ]
+        try:
+            self.save_summary(phone_number, self.summarize(prompt), turns[-1]['timestamp'])
+        except Exception as e:
+            logger.warning(f"Summary update failed, keeping previous summary: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(phone_number)
+
+    def close(self):
+        """Wait for summary refreshes still running in this process."""
+        with self._lock:
+            pool = self._pool if self._pool_pid == os.getpid() else None
+            self._pool = None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+def _transcript(summary: Optional[str], turns: List[Dict]) -> str:
+    lines = [f"Current summary: {summary or '(none)'}", "New turns:"]
+    for turn in turns:
+        lines.append(f"Patient: {turn['message']}")
+        lines.append(f"Assistant: {turn['response']}")
+    return '\n'.join(lines)
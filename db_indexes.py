@@ -0,0 +1,50 @@
+import logging
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Indexes backing the hot queries: get_user/save_user, get_chat_history and
+# the handoff queue lookups, plus document ingestion and vector index sync.
+INDEXES = {
+    'users': [
+        ([('phone_number', ASCENDING)], {'unique': True}),
+    ],
+    'chats': [
+        ([('phone_number', ASCENDING), ('timestamp', DESCENDING)], {}),
+    ],
+    'handoffs': [
+        ([('status', ASCENDING), ('created_at', ASCENDING)], {}),
+        ([('status', ASCENDING), ('queue_key', ASCENDING), ('_id', ASCENDING)], {}),
+        ([('user_id', ASCENDING), ('status', ASCENDING)], {}),
+        # At most one waiting request per user, even when two requests race
+        ([('user_id', ASCENDING)],
+         {'unique': True, 'partialFilterExpression': {'status': 'waiting'}}),
+    ],
+    'processed_messages': [
+        ([('created_at', ASCENDING)], {'expireAfterSeconds': 24 * 3600}),
+    ],
+    'documents': [
+        # Ingestion dedupes on content_hash; older documents may lack it
+        ([('content_hash', ASCENDING)],
+         {'unique': True, 'partialFilterExpression': {'content_hash': {'$exists': True}}}),
+        ([('embedding_format', ASCENDING)], {'sparse': True}),
+        ([('embedding_updated_at', DESCENDING)], {'sparse': True}),
+    ],
+    'agents': [
+        ([('status', ASCENDING), ('active_count', ASCENDING)], {}),
+        ([('agent_id', ASCENDING)], {'unique': True}),
+    ],
+}
+
+
+def ensure_indexes(db):
+    """Create any missing indexes. Safe to run on every startup."""
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                name = db[collection].create_index(keys, background=True, **options)
+                logger.info(f"Index {collection}.{name} ready")
+            except PyMongoError as e:
+                logger.error(f"Index creation error on {collection} {keys}: {e}")
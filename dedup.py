@@ -0,0 +1,246 @@
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+import threading
+import time
+import logging
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+PENDING = object()
+
+
+class _Claim:
+    __slots__ = ('reply', 'expires_at', 'done', 'remote', 'orphaned')
+
+    def __init__(self, expires_at: float, remote: bool = False):
+        self.reply = PENDING
+        self.expires_at = expires_at
+        self.done = threading.Event()
+        self.remote = remote
+        self.orphaned = False
+
+
+class SeenMessages:
+    """TTL'd record of webhook ``MessageSid`` values already being handled.
+
+    ``start`` claims a sid; a retry of the same sid gets back the reply the
+    first delivery produced, or ``PENDING`` while it is still running, in
+    which case ``wait`` holds the retry until that reply exists. With a
+    ``collection`` the claim and its reply are also recorded in MongoDB so
+    retries landing on another worker are caught; that collection wants a
+    TTL index on ``created_at`` (see ``db_indexes``).
+
+    A retry that gives up waiting marks the claim orphaned; ``finish`` then
+    returns True so the first delivery sends its reply out of band.
+    """
+
+    def __init__(self, ttl: float = 3600, max_size: int = 100000, collection=None,
+                 poll_interval: float = 0.2):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.duplicates = 0
+        self._entries: "OrderedDict[str, _Claim]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, sid: str):
+        """Return None if ``sid`` is new, else its stored reply or ``PENDING``."""
+        now = time.monotonic()
+        with self._lock:
+            while self._entries:
+                oldest, claim = next(iter(self._entries.items()))
+                if claim.expires_at > now and len(self._entries) < self.max_size:
+                    break
+                del self._entries[oldest]
+            claim = self._entries.get(sid)
+            if claim is not None:
+                self.duplicates += 1
+                return claim.reply
+            claim = self._entries[sid] = _Claim(now + self.ttl)
+        if self.collection is not None:
+            try:
+                self.collection.insert_one({'_id': sid, 'created_at': datetime.utcnow()})
+            except DuplicateKeyError:
+                # Another worker owns it; waiters here poll its record instead
+                doc = self._find(sid)
+                with self._lock:
+                    self.duplicates += 1
+                    claim.remote = True
+                    if doc is not None and 'reply' in doc:
+                        claim.reply = doc['reply']
+                    reply = claim.reply
+                claim.done.set()
+                return reply
+            except Exception as e:
+                logger.error(f"Seen-message store error: {e}")
+        return None
+
+    def wait(self, sid: str, timeout: float):
+        """Wait for a ``PENDING`` sid's reply.
+
+        Returns the reply, ``PENDING`` after ``timeout`` (the claim is then
+        orphaned), or None when the first delivery failed and was forgotten.
+        """
+        with self._lock:
+            claim = self._entries.get(sid)
+        if claim is None:
+            return None
+        if claim.remote:
+            return self._wait_remote(sid, claim, time.monotonic() + timeout)
+        claim.done.wait(timeout)
+        with self._lock:
+            if claim.reply is PENDING:
+                claim.orphaned = True
+            return claim.reply
+
+    def _wait_remote(self, sid: str, claim: _Claim, deadline: float):
+        while True:
+            doc = self._find(sid)
+            if doc is None:
+                self._drop(sid, claim)
+                return None
+            if 'reply' in doc:
+                claim.reply = doc['reply']
+                return claim.reply
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(self.poll_interval, remaining))
+        try:
+            result = self.collection.update_one(
+                {'_id': sid, 'reply': {'$exists': False}},
+                {'$set': {'orphaned': True}}
+            )
+        except Exception as e:
+            logger.error(f"Seen-message store error: {e}")
+            return PENDING
+        if result.matched_count:
+            return PENDING
+        # The reply (or a forget) landed between the last poll and the update
+        doc = self._find(sid)
+        if doc is None:
+            self._drop(sid, claim)
+            return None
+        claim.reply = doc.get('reply', PENDING)
+        return claim.reply
+
+    def _find(self, sid: str) -> Optional[Dict]:
+        try:
+            return self.collection.find_one({'_id': sid})
+        except Exception as e:
+            logger.error(f"Seen-message store error: {e}")
+            return {'_id': sid}
+
+    def _drop(self, sid: str, claim: _Claim):
+        with self._lock:
+            if self._entries.get(sid) is claim:
+                del self._entries[sid]
+
+    def forget(self, sid: str):
+        with self._lock:
+            claim = self._entries.pop(sid, None)
+            if claim is not None:
+                claim.reply = None
+        if claim is not None:
+            claim.done.set()
+        if self.collection is not None:
+            try:
+                self.collection.delete_one({'_id': sid})
+            except Exception as e:
+                logger.error(f"Seen-message store error: {e}")
+
+    def finish(self, sid: str, reply: Optional[str]) -> bool:
+        """Record ``sid``'s reply; True if a retry gave up waiting for it."""
+        with self._lock:
+            claim = self._entries.get(sid)
+            orphaned = False
+            if claim is not None:
+                claim.reply = reply
+                orphaned = claim.orphaned
+        if claim is not None:
+            claim.done.set()
+        if self.collection is not None:
+            try:
+                doc = self.collection.find_one_and_update({'_id': sid}, {'$set': {'reply': reply}})
+                orphaned = orphaned or bool(doc and doc.get('orphaned'))
+            except Exception as e:
+                logger.error(f"Seen-message store error: {e}")
+        return orphaned
+
+
+class UserLocks:
+    """One lock per phone number, dropped again once nobody holds or waits on it."""
+
+    def __init__(self):
+        self._locks: Dict[str, Tuple[threading.Lock, int]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, phone_number: str):
+        with self._lock:
+            lock, users = self._locks.get(phone_number, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self._locks[phone_number] = (lock, users + 1)
+        lock.acquire()
+        try:
+            yield
+        finally:
+            lock.release()
+            with self._lock:
+                lock, users = self._locks[phone_number]
+                if users == 1:
+                    del self._locks[phone_number]
+                else:
+                    self._locks[phone_number] = (lock, users - 1)
+
+
+class _Batch:
+    __slots__ = ('messages', 'opened_at')
+
+    def __init__(self, message: str):
+        self.messages: List[str] = [message]
+        self.opened_at = time.monotonic()
+
+
+class MessageCoalescer:
+    """Merges a burst of messages from one sender into a single LLM turn.
+
+    The first message opens a batch for ``window`` seconds; messages arriving
+    while it is open are appended and their callers answer nothing. The
+    batch's owner calls ``collect``, which waits out the window and returns
+    the combined text.
+    """
+
+    def __init__(self, window: float = 1.5):
+        self.window = window
+        self.coalesced = 0
+        self._open: Dict[str, _Batch] = {}
+        self._lock = threading.Lock()
+
+    def add(self, phone_number: str, message: str) -> Tuple[_Batch, bool]:
+        """Return ``(batch, owner)``; only the owner should process the batch."""
+        with self._lock:
+            batch = self._open.get(phone_number)
+            if batch is not None:
+                batch.messages.append(message)
+                self.coalesced += 1
+                return batch, False
+            batch = _Batch(message)
+            if self.window > 0:
+                self._open[phone_number] = batch
+            return batch, True
+
+    def collect(self, phone_number: str, batch: _Batch) -> str:
+        remaining = batch.opened_at + self.window - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        with self._lock:
+            if self._open.get(phone_number) is batch:
+                del self._open[phone_number]
+            return '\n'.join(batch.messages)
@@ -0,0 +1,131 @@
+"""Out-of-process embedding server over a local Unix socket.
+
+Run one server per host so web workers never load model weights:
+
+    python embedding_server.py --socket /tmp/embeddings.sock
+
+and start the web app with ``EMBEDDING_SERVER_SOCKET=/tmp/embeddings.sock``.
+Each frame is a 4-byte big-endian length followed by a JSON header; an
+embedding response header is followed by ``rows * dim`` float32 values.
+"""
+from typing import List, Union
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _send_frame(sock, header: dict, payload: bytes = b''):
+    data = json.dumps(header).encode('utf-8')
+    sock.sendall(struct.pack('>I', len(data)) + data + payload)
+
+
+def _recv_exact(sock, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("Embedding server connection closed")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def _recv_frame(sock) -> dict:
+    (size,) = struct.unpack('>I', _recv_exact(sock, 4))
+    return json.loads(_recv_exact(sock, size))
+
+
+class RemoteModel:
+    """Client exposing the subset of ``SentenceTransformer.encode`` used here."""
+
+    def __init__(self, socket_path: str, name: str, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.name = name
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 32,
+               convert_to_tensor: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        request = {'model': self.name, 'texts': [texts] if single else list(texts),
+                   'batch_size': batch_size}
+        sock = self._connection()
+        try:
+            _send_frame(sock, request)
+            header = _recv_frame(sock)
+            if 'error' in header:
+                raise RuntimeError(header['error'])
+            rows, dim = header['shape']
+            data = _recv_exact(sock, rows * dim * 4)
+        except Exception:
+            sock.close()
+            self._local.sock = None
+            raise
+        vectors = np.frombuffer(data, dtype=np.float32).reshape(rows, dim)
+        return vectors[0] if single else vectors
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = _recv_frame(self.request)
+            except (ConnectionError, struct.error):
+                return
+            try:
+                from model_registry import get_model
+                model = get_model(request['model'], allow_remote=False)
+                vectors = np.asarray(
+                    model.encode(request['texts'], batch_size=request.get('batch_size', 32),
+                                 convert_to_tensor=False),
+                    dtype=np.float32
+                ).reshape(len(request['texts']), -1)
+                _send_frame(self.request, {'shape': list(vectors.shape)}, vectors.tobytes())
+            except Exception as e:
+                logger.error(f"Embedding server error: {e}")
+                _send_frame(self.request, {'error': str(e)})
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, _Handler)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Serve sentence embeddings over a Unix socket')
+    parser.add_argument('--socket', default=os.getenv('EMBEDDING_SERVER_SOCKET',
+                                                      '/tmp/embeddings.sock'))
+    parser.add_argument('--model', default=None)
+    args = parser.parse_args()
+
+    from model_registry import MODEL_NAME, get_model
+    get_model(args.model or MODEL_NAME, allow_remote=False).encode(['query: warmup'])
+    with EmbeddingServer(args.socket) as server:
+        logger.info(f"Embedding server listening on {args.socket}")
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import gc
+import os
+
+# Picked up automatically by `gunicorn app:app` from the working directory.
+
+# gevent must patch the stdlib before anything creates sockets or locks. The
+# master loads this file first, ahead of any preloaded app or embedding model,
+# so patch here rather than relying on the worker's own late patch.
+if os.getenv('GUNICORN_WORKER_CLASS') == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+
+# Threaded workers keep serving other webhooks while one waits on the LLM.
+# Set GUNICORN_WORKER_CLASS=gevent (with gevent installed) for many more
+# concurrent requests per worker at the same memory cost.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 200))
+
+# app.py does no I/O at import and creates its MongoDB client, LLM session
+# and background threads per process, so the app can be imported once in the
+# master and shared copy-on-write. Off by default under gevent: module-level
+# locks and imports are then made in each worker, after its patch.
+preload_app = os.getenv('GUNICORN_PRELOAD', '0' if worker_class == 'gevent' else '1') == '1'
+
+# Above the LLM read timeout so a slow upstream ends in the fallback reply,
+# not a killed worker; graceful_timeout leaves time to flush chat logs.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+# Recycle workers now and then to bound memory growth.
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = 500
+
+
+def on_starting(server):
+    # Load embedding weights once in the master; forked workers then share
+    # the pages copy-on-write. No inference runs here, so no torch thread
+    # pools exist before the fork.
+    if os.getenv('PRELOAD_EMBEDDING_MODEL') == '1' and not os.getenv('EMBEDDING_SERVER_SOCKET'):
+        import model_registry
+        model_registry.preload()
+
+
+def when_ready(server):
+    # Keep later GC passes from touching (and so copying) preloaded objects.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if os.getenv('WARMUP_EMBEDDING_MODEL') == '1':
+        import model_registry
+        model_registry.warmup()
+
+
+def worker_exit(server, worker):
+    # Finish queued replies and flush buffered chat records before exiting.
+    import app
+    app.shutdown_services()
@@ -1,17 +1,61 @@
-from typing import Optional
-from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+from datetime import datetime, timedelta
+import threading
 import logging
-from models import UserStatus, HandoffStatus
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from models import UserStatus, HandoffStatus, AgentStatus, HandoffPriority, Agent
 
 logger = logging.getLogger(__name__)
 
 class HandoffHandler:
-    def __init__(self, users_collection, handoff_collection, agents_collection):
+    """Handoff queue backed by MongoDB.
+
+    Requests are ordered by ``queue_key``: the creation time moved earlier by
+    ``aging_seconds`` per priority level. A higher priority therefore jumps
+    ahead of recent requests, yet anything that has waited long enough still
+    reaches the front. Claims use ``find_one_and_update``, so two agents never
+    get the same request, and agent capacity is reserved with the same
+    atomic update before a request is taken.
+    """
+
+    def __init__(self, users_collection, handoff_collection, agents_collection,
+                 aging_seconds: float = 300):
         self.users = users_collection
         self.handoffs = handoff_collection
         self.agents = agents_collection
+        self.aging_seconds = aging_seconds
+        self._lock = threading.Lock()
+        self.metrics = {'requested': 0, 'assigned': 0, 'completed': 0,
+                        'wait_total': 0.0, 'wait_max': 0.0}
 
-    def request_handoff(self, user_id: str) -> bool:
+    def register_agent(self, agent: Agent) -> bool:
+        try:
+            doc = agent.to_document()
+            created_at = doc.pop('created_at')
+            # active_count is owned by _reserve_agent/_release_agent; re-registering
+            # must not reset it while the agent still holds assigned requests
+            self.agents.update_one(
+                {'agent_id': agent.agent_id},
+                {'$set': doc, '$setOnInsert': {'created_at': created_at, 'active_count': 0}},
+                upsert=True
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Agent registration error: {e}")
+            return False
+
+    def set_agent_status(self, agent_id: str, status: AgentStatus) -> bool:
+        try:
+            result = self.agents.update_one({'agent_id': agent_id},
+                                            {'$set': {'status': status.value}})
+            return result.matched_count > 0
+        except Exception as e:
+            logger.error(f"Agent status error: {e}")
+            return False
+
+    def request_handoff(self, user_id: str,
+                        priority: HandoffPriority = HandoffPriority.NORMAL) -> bool:
         try:
             # Update user status
             self.users.update_one(
@@ -19,45 +63,181 @@ class HandoffHandler:
                 {'$set': {'status': UserStatus.PENDING.value}}
             )
 
-            # Create handoff request
-            handoff = {
-                'user_id': user_id,
-                'status': HandoffStatus.WAITING.value,
-                'created_at': datetime.utcnow(),
-                'agent_id': None
-            }
-            self.handoffs.insert_one(handoff)
+            # Create handoff request, at most one waiting per user; the unique
+            # index turns a racing second upsert into a DuplicateKeyError
+            now = datetime.utcnow()
+            try:
+                self.handoffs.update_one(
+                    {'user_id': user_id, 'status': HandoffStatus.WAITING.value},
+                    {'$setOnInsert': {
+                        'created_at': now,
+                        'priority': priority.value,
+                        'queue_key': now - timedelta(seconds=priority.value * self.aging_seconds),
+                        'agent_id': None
+                    }},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                # Another call queued this user first
+                pass
+            self._count('requested')
             return True
         except Exception as e:
             logger.error(f"Handoff request error: {e}")
             return False
 
-    def get_pending_requests(self):
+    def get_pending_requests(self, limit: int = 50, after: Optional[Dict] = None) -> List[Dict]:
+        """One page of waiting requests in claim order.
+
+        Pass the last request of a page as ``after`` for the next one. Pages are
+        keyed on ``(queue_key, _id)`` because requests can share a ``queue_key``.
+        """
         try:
-            return list(self.handoffs.find({'status': HandoffStatus.WAITING.value}))
+            query = {'status': HandoffStatus.WAITING.value}
+            if after is not None:
+                query['$or'] = [
+                    {'queue_key': {'$gt': after['queue_key']}},
+                    {'queue_key': after['queue_key'], '_id': {'$gt': after['_id']}}
+                ]
+            return list(self.handoffs.find(query)
+                        .sort([('queue_key', ASCENDING), ('_id', ASCENDING)])
+                        .limit(limit))
         except Exception as e:
             logger.error(f"Get pending requests error: {e}")
             return []
 
-    def assign_agent(self, request_id: str, agent_id: str) -> bool:
-        try:
-            result = self.handoffs.update_one(
-                {'_id': request_id, 'status': HandoffStatus.WAITING.value},
-                {
-                    '$set': {
-                        'status': HandoffStatus.ASSIGNED.value,
-                        'agent_id': agent_id,
-                        'assigned_at': datetime.utcnow()
-                    }
-                }
+    def iter_pending_requests(self, batch_size: int = 100) -> Iterator[Dict]:
+        after = None
+        while True:
+            page = self.get_pending_requests(limit=batch_size, after=after)
+            yield from page
+            if len(page) < batch_size:
+                return
+            after = page[-1]
+
+    def _reserve_agent(self, agent_id: Optional[str] = None) -> Optional[Dict]:
+        """Take one capacity slot from ``agent_id``, or the least-loaded available agent."""
+        query = {
+            'status': AgentStatus.AVAILABLE.value,
+            '$expr': {'$lt': ['$active_count', '$capacity']}
+        }
+        if agent_id is not None:
+            query['agent_id'] = agent_id
+        return self.agents.find_one_and_update(
+            query,
+            {'$inc': {'active_count': 1}},
+            sort=[('active_count', ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _release_agent(self, agent_id: str):
+        self.agents.update_one({'agent_id': agent_id, 'active_count': {'$gt': 0}},
+                               {'$inc': {'active_count': -1}})
+
+    def _take(self, query: Dict, agent_id: str) -> Optional[Dict]:
+        """Assign a waiting request to ``agent_id``, whose slot is already reserved.
+
+        The slot is given back if no request is taken, including on error.
+        """
+        try:
+            handoff = self.handoffs.find_one_and_update(
+                {**query, 'status': HandoffStatus.WAITING.value},
+                {'$set': {
+                    'status': HandoffStatus.ASSIGNED.value,
+                    'agent_id': agent_id,
+                    'assigned_at': datetime.utcnow()
+                }},
+                sort=[('queue_key', ASCENDING), ('_id', ASCENDING)],
+                return_document=ReturnDocument.AFTER
             )
-            if result.modified_count > 0:
-                self.users.update_one(
-                    {'phone_number': request_id},
-                    {'$set': {'status': UserStatus.WITH_AGENT.value}}
-                )
-                return True
-            return False
+        except Exception:
+            self._release_agent(agent_id)
+            raise
+        if handoff is None:
+            self._release_agent(agent_id)
+            return None
+        self.users.update_one(
+            {'phone_number': handoff['user_id']},
+            {'$set': {'status': UserStatus.WITH_AGENT.value}}
+        )
+        wait = (handoff['assigned_at'] - handoff['created_at']).total_seconds()
+        with self._lock:
+            self.metrics['assigned'] += 1
+            self.metrics['wait_total'] += wait
+            self.metrics['wait_max'] = max(self.metrics['wait_max'], wait)
+        return handoff
+
+    def claim_next(self, agent_id: str) -> Optional[Dict]:
+        """Atomically hand the front of the queue to ``agent_id`` if it has capacity."""
+        try:
+            if self._reserve_agent(agent_id) is None:
+                return None
+            return self._take({}, agent_id)
+        except Exception as e:
+            logger.error(f"Claim error: {e}")
+            return None
+
+    def auto_assign(self, max_assignments: Optional[int] = None) -> List[Dict]:
+        """Assign waiting requests to the least-loaded available agents until
+        the queue is empty or every agent is at capacity."""
+        assigned = []
+        try:
+            while max_assignments is None or len(assigned) < max_assignments:
+                agent = self._reserve_agent()
+                if agent is None:
+                    break
+                handoff = self._take({}, agent['agent_id'])
+                if handoff is None:
+                    break
+                assigned.append(handoff)
+        except Exception as e:
+            logger.error(f"Auto-assign error: {e}")
+        return assigned
+
+    def assign_agent(self, request_id, agent_id: str) -> bool:
+        try:
+            if self._reserve_agent(agent_id) is None:
+                return False
+            return self._take({'_id': request_id}, agent_id) is not None
         except Exception as e:
             logger.error(f"Agent assignment error: {e}")
             return False
+
+    def complete_handoff(self, request_id) -> bool:
+        try:
+            handoff = self.handoffs.find_one_and_update(
+                {'_id': request_id, 'status': HandoffStatus.ASSIGNED.value},
+                {'$set': {'status': HandoffStatus.COMPLETED.value,
+                          'completed_at': datetime.utcnow()}}
+            )
+            if handoff is None:
+                return False
+            self._release_agent(handoff['agent_id'])
+            self.users.update_one(
+                {'phone_number': handoff['user_id']},
+                {'$set': {'status': UserStatus.BOT.value}}
+            )
+            self._count('completed')
+            return True
+        except Exception as e:
+            logger.error(f"Handoff completion error: {e}")
+            return False
+
+    def _count(self, key: str):
+        with self._lock:
+            self.metrics[key] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.metrics)
+        stats['wait_avg'] = stats['wait_total'] / stats['assigned'] if stats['assigned'] else 0.0
+        try:
+            stats['queue_depth'] = self.handoffs.count_documents(
+                {'status': HandoffStatus.WAITING.value})
+            oldest = self.handoffs.find_one({'status': HandoffStatus.WAITING.value},
+                                            sort=[('created_at', ASCENDING)])
+            stats['oldest_wait'] = ((datetime.utcnow() - oldest['created_at']).total_seconds()
+                                    if oldest else 0.0)
+        except Exception as e:
+            logger.error(f"Handoff stats error: {e}")
+        return stats
@@ -0,0 +1,202 @@
+from typing import Dict, List, Optional, Tuple
+import os
+import random
+import threading
+import time
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = 'https://api.perplexity.ai'
+DEFAULT_MODEL = 'llama-3.1-sonar-small-128k-online'
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMUnavailable(LLMError):
+    """Raised without calling upstream: circuit open or concurrency limit hit."""
+
+
+class LLMRequestRejected(LLMError):
+    """Upstream answered with a 4xx other than 429: this request was bad, the
+    service is fine, so it does not count against the circuit breaker."""
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures and lets a single
+    trial call through once ``reset_timeout`` seconds have passed."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"LLM circuit opened after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class LLMClient:
+    """Chat-completions client with a keep-alive pool, timeouts, jittered
+    retries, a circuit breaker and a per-process concurrency limit."""
+
+    def __init__(self, api_key: Optional[str] = None, base_url: str = DEFAULT_BASE_URL,
+                 model: str = DEFAULT_MODEL, connect_timeout: float = 3.05,
+                 read_timeout: float = 10.0, max_retries: int = 2, backoff: float = 0.5,
+                 max_backoff: float = 4.0, max_concurrency: int = 8,
+                 acquire_timeout: float = 1.0, pool_size: int = 10,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.acquire_timeout = acquire_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def complete(self, messages: List[Dict], **params) -> str:
+        return self.complete_with_usage(messages, **params)[0]
+
+    def complete_with_usage(self, messages: List[Dict], **params) -> Tuple[str, Dict]:
+        """Return the assistant reply for ``messages`` and the reported token usage.
+
+        Raises ``LLMUnavailable`` immediately when the circuit is open or no
+        concurrency slot frees up within ``acquire_timeout``, and ``LLMError``
+        when upstream fails after retries.
+        """
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise LLMUnavailable("Too many concurrent LLM requests")
+        if not self.breaker.allow():
+            self._slots.release()
+            raise LLMUnavailable("LLM circuit is open")
+        try:
+            response = self._post({'model': self.model, 'messages': messages, **params})
+        except LLMRequestRejected:
+            self.breaker.record_success()
+            raise
+        except LLMError:
+            self.breaker.record_failure()
+            raise
+        finally:
+            self._slots.release()
+        self.breaker.record_success()
+        try:
+            body = response.json()
+            return body['choices'][0]['message']['content'], body.get('usage') or {}
+        except (ValueError, KeyError, IndexError) as e:
+            raise LLMError(f"Malformed LLM response: {e}")
+
+    def _post(self, payload: Dict) -> requests.Response:
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        url = f"{self.base_url}/chat/completions"
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = self.session.post(url, headers=headers, json=payload,
+                                             timeout=self.timeout)
+            except requests.ConnectionError as e:
+                if attempt == self.max_retries:
+                    raise LLMError(f"LLM request failed: {e}")
+                logger.warning(f"LLM connection error, retrying: {e}")
+            except requests.RequestException as e:
+                # Read timeouts are not retried: upstream already held this
+                # worker for the full read timeout.
+                raise LLMError(f"LLM request failed: {e}")
+            else:
+                if response.status_code == 200:
+                    return response
+                if response.status_code < 500 and response.status_code != 429:
+                    raise LLMRequestRejected(f"LLM rejected request with status "
+                                             f"{response.status_code}")
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    raise LLMError(f"LLM returned status {response.status_code}")
+                retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+                logger.warning(f"LLM returned {response.status_code}, retrying")
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            if retry_after is not None:
+                delay = min(max(delay, retry_after), self.max_backoff)
+            time.sleep(delay)
+        raise LLMError("LLM retries exhausted")
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+_client: Optional[LLMClient] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> LLMClient:
+    """Per-process client configured from the environment.
+
+    The pid check makes a client created before a fork unreachable from the
+    child, so workers never share pooled sockets with the master.
+    """
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = LLMClient(
+                api_key=os.getenv('PERPLEXITY_API_KEY'),
+                base_url=os.getenv('PERPLEXITY_BASE_URL', DEFAULT_BASE_URL),
+                model=os.getenv('PERPLEXITY_MODEL', DEFAULT_MODEL),
+                connect_timeout=float(os.getenv('LLM_CONNECT_TIMEOUT', 3.05)),
+                # Connect plus read stays under Twilio's 15s webhook timeout
+                read_timeout=float(os.getenv('LLM_READ_TIMEOUT', 10)),
+                max_retries=int(os.getenv('LLM_MAX_RETRIES', 2)),
+                max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', 8)),
+                breaker=CircuitBreaker(
+                    failure_threshold=int(os.getenv('LLM_BREAKER_THRESHOLD', 5)),
+                    reset_timeout=float(os.getenv('LLM_BREAKER_RESET', 30))
+                )
+            )
+            _client_pid = os.getpid()
+        return _client
@@ -0,0 +1,194 @@
+"""In-process metrics with Prometheus text exposition.
+
+Each process keeps its own registry; under gunicorn every worker reports
+its own numbers, so scrape with a per-worker target or sum in queries.
+"""
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.01))
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, **labels) -> Optional[Dict]:
+        with self._lock:
+            series = self._series.get(_labels(labels))
+            if series is None:
+                return None
+            return {'buckets': list(series[0]), 'sum': series[1], 'count': series[2]}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f"{self.name}_bucket{_format_labels(key, ('le', repr(bound)))} "
+                                 f"{cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict, float]]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str) -> Counter:
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, help, buckets))
+
+    def register_collector(self, collect: Callable[[], Iterable[Tuple[str, str, str, Dict, float]]]):
+        """Add a callback yielding ``(name, type, help, labels, value)`` at scrape time."""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        seen = set()
+        for collect in collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                logging.getLogger(__name__).error(f"Metrics collector error: {e}")
+                continue
+            for name, kind, help, labels, value in samples:
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {help}")
+                    lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name}{_format_labels(_labels(labels))} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'bot_stage_duration_seconds', 'Time spent in each hot-path stage')
+STAGE_ERRORS = REGISTRY.counter(
+    'bot_stage_errors_total', 'Exceptions raised inside a timed stage')
+
+
+@contextmanager
+def timed(stage: str, ignore: Tuple[type, ...] = ()):
+    """Record the duration of the enclosed block under ``stage``.
+
+    Exceptions count as stage errors unless they are instances of ``ignore``,
+    for exceptions that are ordinary control flow.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        if not isinstance(e, ignore):
+            STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def timed_stage(stage: str, ignore: Tuple[type, ...] = ()):
+    """Decorator form of ``timed``."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage, ignore):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO,
+              sample_rate: Optional[float] = None, **fields):
+    """Log ``event`` as one JSON line, keeping only a ``sample_rate`` fraction.
+
+    Sampling happens before anything is formatted, so dropped events cost
+    one random draw. Warnings and errors are never sampled out.
+    """
+    rate = LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+    if level < logging.WARNING and rate < 1.0 and random.random() >= rate:
+        return
+    if not logger.isEnabledFor(level):
+        return
+    record = {'event': event, **fields}
+    if level < logging.WARNING and rate < 1.0:
+        record['sample_rate'] = rate
+    logger.log(level, json.dumps(record, default=str))
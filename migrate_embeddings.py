@@ -0,0 +1,89 @@
+"""Convert stored RAG embeddings between storage formats.
+
+    python migrate_embeddings.py --format int8
+    python migrate_embeddings.py --report --sample 5000
+"""
+from datetime import datetime
+import argparse
+import logging
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+from quantization import FORMATS, decode_embedding, encode_embedding, recall_report, stored_values
+
+logger = logging.getLogger(__name__)
+
+
+def migrate(collection, fmt: str, batch_size: int = 500) -> int:
+    """Rewrite every document not already stored as ``fmt``. Returns the count."""
+    if fmt == 'float32':
+        query = {'embedding_format': {'$exists': True}}
+    else:
+        query = {'embedding_format': {'$ne': fmt}}
+    query['embedding'] = {'$exists': True}
+    projection = {'embedding': 1, 'embedding_format': 1, 'embedding_scale': 1}
+    converted = 0
+    ops = []
+    for doc in collection.find(query, projection, batch_size=batch_size):
+        fields = encode_embedding(decode_embedding(doc), fmt)
+        # Tells local vector indexes to re-read re-encoded documents
+        fields['embedding_updated_at'] = datetime.utcnow()
+        update = {'$set': fields}
+        if fmt == 'float32':
+            update['$unset'] = {'embedding_format': '', 'embedding_scale': ''}
+        ops.append(UpdateOne({'_id': doc['_id']}, update))
+        if len(ops) >= batch_size:
+            converted += collection.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        converted += collection.bulk_write(ops, ordered=False).modified_count
+    logger.info(f"Converted {converted} embeddings to {fmt}")
+    return converted
+
+
+def sample_vectors(collection, sample: int) -> np.ndarray:
+    docs = collection.aggregate([
+        {'$match': {'embedding': {'$exists': True}}},
+        {'$sample': {'size': sample}},
+        {'$project': {'embedding': 1, 'embedding_format': 1, 'embedding_scale': 1}}
+    ])
+    rows = []
+    for doc in docs:
+        if stored_values(doc)[2] != 'float32':
+            logger.warning("Sample contains quantized vectors; recall is measured against them")
+        rows.append(decode_embedding(doc))
+    return np.stack(rows)
+
+
+def main():
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uri', default=os.getenv('MONGODB_URI'))
+    parser.add_argument('--db', default='healthcare_bot')
+    parser.add_argument('--collection', default='documents')
+    parser.add_argument('--format', choices=FORMATS)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--report', action='store_true',
+                        help='print recall@k and bytes per vector for each format')
+    parser.add_argument('--sample', type=int, default=2000)
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+    if not args.uri:
+        parser.error('--uri or MONGODB_URI is required')
+
+    collection = MongoClient(args.uri)[args.db][args.collection]
+    if args.report:
+        vectors = sample_vectors(collection, args.sample)
+        print(f"{'format':<8} {'bytes/vec':>10} {'recall@' + str(args.k):>10}")
+        for row in recall_report(vectors, k=args.k):
+            print(f"{row['format']:<8} {row['bytes_per_vector']:>10} {row['recall_at_k']:>10.4f}")
+    if args.format:
+        migrate(collection, args.format, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
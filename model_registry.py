@@ -0,0 +1,69 @@
+from typing import Dict, Optional, Tuple
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = 'intfloat/e5-base-v2'
+
+_models: Dict[Tuple[str, Optional[str]], object] = {}
+_lock = threading.Lock()
+
+
+def get_model(name: str = MODEL_NAME, allow_remote: bool = True):
+    """Return the process-wide model for ``name``, loading it on first use.
+
+    When ``EMBEDDING_SERVER_SOCKET`` is set the model lives in a separate
+    embedding server process and a thin client is returned instead, unless
+    ``allow_remote`` is false (as in the server itself).
+    """
+    socket_path = os.getenv('EMBEDDING_SERVER_SOCKET') if allow_remote else None
+    key = (name, socket_path)
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            model = _load(name, socket_path)
+            _models[key] = model
+        return model
+
+
+def _load(name: str, socket_path: Optional[str] = None):
+    if socket_path:
+        from embedding_server import RemoteModel
+        logger.info(f"Using embedding server at {socket_path} for {name}")
+        return RemoteModel(socket_path, name)
+    from sentence_transformers import SentenceTransformer
+    start = time.monotonic()
+    model = SentenceTransformer(name)
+    logger.info(f"Loaded {name} in {time.monotonic() - start:.1f}s")
+    return model
+
+
+def register_model(name: str, model):
+    """Serve ``model`` for ``name`` in this process instead of loading weights,
+    e.g. a stub encoder in benchmarks."""
+    with _lock:
+        _models[(name, None)] = model
+        _models[(name, os.getenv('EMBEDDING_SERVER_SOCKET'))] = model
+
+
+def is_loaded(name: str = MODEL_NAME) -> bool:
+    return any(key[0] == name for key in _models)
+
+
+def preload(name: str = MODEL_NAME):
+    """Load weights without running inference, e.g. in the gunicorn master
+    before forking so workers share the pages copy-on-write."""
+    get_model(name)
+
+
+def warmup(name: str = MODEL_NAME):
+    """Load the model and run one encode so the first request is not slow."""
+    start = time.monotonic()
+    get_model(name).encode(['query: warmup'], convert_to_tensor=False)
+    logger.info(f"Warmed up {name} in {time.monotonic() - start:.2f}s")
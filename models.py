@@ -16,17 +16,32 @@ class AgentStatus(Enum):
     BUSY = "busy"
     OFFLINE = "offline"
 
+class HandoffPriority(Enum):
+    NORMAL = 0
+    HIGH = 1
+    URGENT = 2
+
 class Agent:
-    def __init__(self, agent_id: str, name: str):
+    def __init__(self, agent_id: str, name: str, capacity: int = 3):
         self.agent_id = agent_id
         self.name = name
         self.status = AgentStatus.OFFLINE
-        self.active_chats = []
+        self.capacity = capacity
         self.created_at = datetime.utcnow()
 
+    def to_document(self) -> dict:
+        return {
+            'agent_id': self.agent_id,
+            'name': self.name,
+            'status': self.status.value,
+            'capacity': self.capacity,
+            'created_at': self.created_at
+        }
+
 class HandoffRequest:
-    def __init__(self, user_id, timestamp=None):
+    def __init__(self, user_id, timestamp=None, priority=HandoffPriority.NORMAL):
         self.user_id = user_id
         self.status = HandoffStatus.WAITING
         self.agent_id = None
+        self.priority = priority
         self.timestamp = timestamp or datetime.utcnow()
@@ -0,0 +1,99 @@
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import numpy as np
+from bson.binary import Binary
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('float32', 'float16', 'int8')
+
+DTYPES = {
+    'float32': np.float32,
+    'float16': np.float16,
+    'int8': np.int8
+}
+
+
+def quantize(vector, fmt: str) -> Tuple[np.ndarray, float]:
+    """Return ``(values, scale)`` such that ``values * scale ~= vector``."""
+    v = np.asarray(vector, dtype=np.float32)
+    if fmt == 'float32':
+        return v, 1.0
+    norm = float(np.linalg.norm(v))
+    if norm == 0.0:
+        return np.zeros(v.shape, dtype=DTYPES[fmt]), 0.0
+    unit = v / norm
+    if fmt == 'float16':
+        return unit.astype(np.float16), norm
+    if fmt == 'int8':
+        peak = float(np.abs(unit).max())
+        return np.round(unit * (127.0 / peak)).astype(np.int8), norm * peak / 127.0
+    raise ValueError(f"Unknown embedding format: {fmt}")
+
+
+def encode_embedding(vector, fmt: str) -> Dict:
+    """Document fields storing ``vector`` in format ``fmt``."""
+    if fmt == 'float32':
+        return {'embedding': np.asarray(vector, dtype=np.float32).tolist()}
+    values, scale = quantize(vector, fmt)
+    return {
+        'embedding': Binary(values.tobytes()),
+        'embedding_format': fmt,
+        'embedding_scale': scale
+    }
+
+
+def stored_values(doc: Dict) -> Tuple[np.ndarray, float, str]:
+    """The raw ``(values, scale, format)`` of a stored document's embedding."""
+    fmt = doc.get('embedding_format', 'float32')
+    raw = doc['embedding']
+    if fmt == 'float32':
+        return np.asarray(raw, dtype=np.float32), 1.0, fmt
+    return np.frombuffer(raw, dtype=DTYPES[fmt]), float(doc['embedding_scale']), fmt
+
+
+def decode_embedding(doc: Dict) -> np.ndarray:
+    values, scale, _ = stored_values(doc)
+    return values.astype(np.float32) * scale
+
+
+def to_format(doc: Dict, fmt: str) -> Tuple[np.ndarray, float]:
+    """A stored embedding in ``fmt``, reusing the stored bytes when they match."""
+    values, scale, stored = stored_values(doc)
+    if stored == fmt:
+        return values, scale
+    return quantize(values.astype(np.float32) * scale, fmt)
+
+
+def bytes_per_vector(dim: int, fmt: str) -> int:
+    """Approximate BSON size of one stored embedding."""
+    if fmt == 'float32':
+        # Array elements are doubles with a type byte and an index key.
+        return sum(1 + len(str(i)) + 1 + 8 for i in range(dim)) + 5
+    return dim * np.dtype(DTYPES[fmt]).itemsize + 5 + 8
+
+
+def recall_report(vectors: np.ndarray, queries: Optional[np.ndarray] = None,
+                  k: int = 10, formats=FORMATS) -> List[Dict]:
+    """Measure recall@k of each storage format against exact float32 search."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if queries is None:
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(len(vectors), min(100, len(vectors)), replace=False)]
+    queries = np.asarray(queries, dtype=np.float32)
+    k = min(k, len(vectors))
+    truth = np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+    report = []
+    for fmt in formats:
+        pairs = [quantize(v, fmt) for v in vectors]
+        values = np.stack([p[0] for p in pairs]).astype(np.float32)
+        scales = np.array([p[1] for p in pairs], dtype=np.float32)
+        approx = np.argsort(-((queries @ values.T) * scales), axis=1)[:, :k]
+        hits = sum(len(set(t) & set(a)) for t, a in zip(truth, approx))
+        report.append({
+            'format': fmt,
+            'bytes_per_vector': bytes_per_vector(vectors.shape[1], fmt),
+            'recall_at_k': hits / float(truth.size)
+        })
+    return report
@@ -1,40 +1,295 @@
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict
+from typing import List, Dict, Optional, Iterable, Iterator, Tuple, Union
+from collections import OrderedDict
 import numpy as np
 from datetime import datetime
+import hashlib
+import threading
+import time
 import logging
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from model_registry import MODEL_NAME, get_model
+from vector_index import VectorIndex, _to_id
+from quantization import encode_embedding, stored_values
+from metrics import timed, timed_stage
 
 logger = logging.getLogger(__name__)
 
+def content_hash(text: str, model_name: str = MODEL_NAME) -> str:
+    return hashlib.sha256(f"{model_name}\0{text}".encode('utf-8')).hexdigest()
+
+
+def chunk_text(text: str, max_words: int = 200, overlap: int = 20) -> List[str]:
+    words = text.split()
+    if len(words) <= max_words:
+        return [text]
+    step = max(max_words - overlap, 1)
+    return [' '.join(words[i:i + max_words]) for i in range(0, len(words), step)
+            if i == 0 or i + overlap < len(words)]
+
+
+class EmbeddingCache:
+    """Thread-safe LRU of embeddings keyed by ``content_hash``."""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: List[float]):
+        if not value:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
 class RAGSystem:
-    def __init__(self, collection):
-        self.model = SentenceTransformer('intfloat/e5-base-v2')
+    def __init__(self, collection, index: Optional[VectorIndex] = None,
+                 approximate: bool = False, cache: Optional[EmbeddingCache] = None,
+                 storage_format: str = 'float32', model_name: str = MODEL_NAME):
+        self.model_name = model_name
         self.collection = collection
+        self.index = index
+        self.approximate = approximate
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.storage_format = storage_format
+        self._compact = None
+        self._compact_checked_at = 0.0
+
+    @property
+    def model(self):
+        return get_model(self.model_name)
 
     def get_embedding(self, text: str) -> List[float]:
+        key = content_hash(text, self.model_name)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
         try:
-            return self.model.encode(text, convert_to_tensor=False).tolist()
+            with timed('rag_embedding'):
+                embedding = self.model.encode(text, convert_to_tensor=False).tolist()
+            self.cache.put(key, embedding)
+            return embedding
         except Exception as e:
             logger.error(f"Embedding error: {e}")
             return []
 
+    def get_embeddings(self, texts: List[str], batch_size: int = 64) -> List[List[float]]:
+        """Embed ``texts`` in batches, only running the model on cache misses."""
+        return self._embed(texts, batch_size)[0]
+
+    def _embed(self, texts: List[str], batch_size: int) -> Tuple[List[List[float]], int]:
+        """Return the embeddings and how many of them the model had to compute."""
+        keys = [content_hash(t, self.model_name) for t in texts]
+        results = [self.cache.get(k) for k in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            with timed('rag_embedding'):
+                encoded = self.model.encode([texts[i] for i in missing], batch_size=batch_size,
+                                            convert_to_tensor=False)
+            for i, embedding in zip(missing, encoded):
+                results[i] = embedding.tolist()
+                self.cache.put(keys[i], results[i])
+        return results, len(missing)
+
     def add_document(self, text: str, metadata: Dict = None):
         try:
             embedding = self.get_embedding(text)
             doc = {
                 'text': text,
-                'embedding': embedding,
+                'content_hash': content_hash(text, self.model_name),
                 'metadata': metadata or {},
-                'timestamp': datetime.utcnow()
+                'timestamp': datetime.utcnow(),
+                **encode_embedding(embedding, self.storage_format)
             }
             self.collection.insert_one(doc)
+        except DuplicateKeyError:
+            logger.info("Document already ingested, skipping")
         except Exception as e:
             logger.error(f"Document addition error: {e}")
 
+    def add_documents(self, documents: Iterable[Union[str, Tuple[str, Dict]]],
+                      batch_size: int = 64, chunk_words: Optional[int] = None) -> Dict:
+        """Stream ``documents`` into the collection in batches.
+
+        Each item is a text or a ``(text, metadata)`` pair. Documents are
+        upserted on their content hash, so re-ingesting unchanged text
+        neither re-runs the model nor writes a duplicate.
+        """
+        stats = {'chunks': 0, 'encoded': 0, 'inserted': 0, 'skipped': 0}
+        batch = []
+        for text, metadata in self._iter_chunks(documents, chunk_words):
+            batch.append((text, metadata))
+            if len(batch) >= batch_size:
+                self._write_batch(batch, batch_size, stats)
+                batch = []
+        if batch:
+            self._write_batch(batch, batch_size, stats)
+        logger.info(f"Ingestion finished: {stats}")
+        return stats
+
+    def _iter_chunks(self, documents, chunk_words) -> Iterator[Tuple[str, Dict]]:
+        for item in documents:
+            text, metadata = (item, {}) if isinstance(item, str) else item
+            metadata = metadata or {}
+            chunks = chunk_text(text, chunk_words) if chunk_words else [text]
+            for n, chunk in enumerate(chunks):
+                if len(chunks) > 1:
+                    yield chunk, {**metadata, 'chunk': n}
+                else:
+                    yield chunk, metadata
+
+    def _write_batch(self, batch: List[Tuple[str, Dict]], batch_size: int, stats: Dict):
+        stats['chunks'] += len(batch)
+        hashes = [content_hash(text, self.model_name) for text, _ in batch]
+        try:
+            existing = {
+                doc['content_hash']
+                for doc in self.collection.find({'content_hash': {'$in': hashes}},
+                                                {'content_hash': 1})
+            }
+            pending = {}
+            for h, (text, metadata) in zip(hashes, batch):
+                if h not in existing and h not in pending:
+                    pending[h] = (text, metadata)
+            stats['skipped'] += len(batch) - len(pending)
+            if not pending:
+                return
+            texts = [text for text, _ in pending.values()]
+            embeddings, encoded = self._embed(texts, batch_size)
+            stats['encoded'] += encoded
+            now = datetime.utcnow()
+            ops = [
+                UpdateOne(
+                    {'content_hash': h},
+                    {'$setOnInsert': {
+                        'text': text,
+                        'content_hash': h,
+                        'metadata': metadata,
+                        'timestamp': now,
+                        **encode_embedding(embedding, self.storage_format)
+                    }},
+                    upsert=True
+                )
+                for (h, (text, metadata)), embedding in zip(pending.items(), embeddings)
+            ]
+            # Matches and duplicate-key errors mean a concurrent ingester got there first
+            try:
+                result = self.collection.bulk_write(ops, ordered=False)
+                stats['inserted'] += result.upserted_count
+                stats['skipped'] += result.matched_count
+            except BulkWriteError as e:
+                duplicates = [err for err in e.details['writeErrors'] if err['code'] == 11000]
+                stats['inserted'] += e.details['nUpserted']
+                stats['skipped'] += e.details['nMatched'] + len(duplicates)
+                if len(duplicates) < len(e.details['writeErrors']):
+                    raise
+        except Exception as e:
+            logger.error(f"Bulk ingestion error: {e}")
+
+    @timed_stage('rag_search')
     def search(self, query: str, limit: int = 5):
+        query_embedding = self.get_embedding(query)
+        if self.index is not None:
+            try:
+                return self._index_search(query_embedding, limit)
+            except Exception as e:
+                logger.error(f"Index search error, falling back to MongoDB: {e}")
+        if self._has_compact_embeddings():
+            return self._scan_search(query_embedding, limit)
+        return self._mongo_search(query_embedding, limit)
+
+    def _has_compact_embeddings(self, recheck: float = 60.0) -> bool:
+        """Whether any stored embedding is BSON Binary, e.g. after ``migrate_embeddings``."""
+        now = time.monotonic()
+        if self._compact is None or now - self._compact_checked_at >= recheck:
+            self._compact = (self.storage_format != 'float32' or self.collection.find_one(
+                {'embedding_format': {'$exists': True}}, {'_id': 1}) is not None)
+            self._compact_checked_at = now
+        return self._compact
+
+    def _index_search(self, query_embedding: List[float], limit: int):
+        self.index.sync(self.collection)
+        hits = self.index.search(query_embedding, limit, approximate=self.approximate)
+        if not hits:
+            return []
+        docs = {
+            str(doc['_id']): doc
+            for doc in self.collection.find(
+                {'_id': {'$in': [_to_id(doc_id) for doc_id, _ in hits]}},
+                {'embedding': 0}
+            )
+        }
+        results = []
+        for doc_id, score in hits:
+            doc = docs.get(doc_id)
+            if doc is not None:
+                doc['similarity'] = score
+                results.append(doc)
+        return results
+
+    def _scan_search(self, query_embedding: List[float], limit: int, batch_size: int = 2048):
+        """Score compact binary embeddings in-process, one cursor batch at a time.
+
+        The aggregation pipeline cannot read BSON Binary vectors, so this is
+        the fallback for quantized storage when no local index is configured.
+        """
+        try:
+            q = np.asarray(query_embedding, dtype=np.float32)
+            best_ids, best_scores = [], np.empty(0, dtype=np.float32)
+            cursor = self.collection.find(
+                {'embedding': {'$exists': True}},
+                {'embedding': 1, 'embedding_format': 1, 'embedding_scale': 1},
+                batch_size=batch_size
+            )
+            ids, rows, scales = [], [], []
+            for doc in cursor:
+                values, scale, _ = stored_values(doc)
+                if len(values) != len(q):
+                    continue
+                ids.append(doc['_id'])
+                rows.append(values)
+                scales.append(scale)
+                if len(ids) >= batch_size:
+                    best_ids, best_scores = _merge_top(best_ids, best_scores, ids, rows,
+                                                       scales, q, limit)
+                    ids, rows, scales = [], [], []
+            if ids:
+                best_ids, best_scores = _merge_top(best_ids, best_scores, ids, rows,
+                                                   scales, q, limit)
+            if not best_ids:
+                return []
+            docs = {doc['_id']: doc for doc in self.collection.find(
+                {'_id': {'$in': best_ids}}, {'embedding': 0})}
+            results = []
+            for doc_id, score in zip(best_ids, best_scores):
+                if doc_id in docs:
+                    docs[doc_id]['similarity'] = float(score)
+                    results.append(docs[doc_id])
+            return results
+        except Exception as e:
+            logger.error(f"Search error: {e}")
+            return []
+
+    def _mongo_search(self, query_embedding: List[float], limit: int):
         try:
-            query_embedding = self.get_embedding(query)
             results = self.collection.aggregate([
+                {"$match": {"embedding_format": {"$exists": False}}},
                 {
                     "$addFields": {
                         "similarity": {
@@ -53,3 +308,13 @@ class RAGSystem:
         except Exception as e:
             logger.error(f"Search error: {e}")
             return []
+
+
+def _merge_top(best_ids, best_scores, ids, rows, scales, q, limit):
+    scores = (np.stack(rows).astype(np.float32) @ q) * np.asarray(scales, dtype=np.float32)
+    all_ids = best_ids + ids
+    all_scores = np.concatenate([best_scores, scores])
+    k = min(limit, len(all_scores))
+    top = np.argpartition(-all_scores, k - 1)[:k]
+    top = top[np.argsort(-all_scores[top])]
+    return [all_ids[i] for i in top], all_scores[top]
@@ -0,0 +1,130 @@
+from typing import Any, Callable, Dict, Optional
+import queue
+import threading
+import time
+import zlib
+import logging
+
+from twilio.http.http_client import TwilioHttpClient
+from twilio.rest import Client
+
+logger = logging.getLogger(__name__)
+
+TWILIO_API_BASE = 'https://api.twilio.com'
+
+
+class _RebasedHttpClient(TwilioHttpClient):
+    """Sends Twilio REST calls to ``api_base`` instead of api.twilio.com."""
+
+    def __init__(self, api_base: str, **kwargs):
+        super().__init__(**kwargs)
+        self.api_base = api_base.rstrip('/')
+
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith(TWILIO_API_BASE):
+            url = self.api_base + url[len(TWILIO_API_BASE):]
+        return super().request(method, url, *args, **kwargs)
+
+
+class TwilioSender:
+    """Delivers WhatsApp replies through the Twilio REST client."""
+
+    def __init__(self, account_sid: str, auth_token: str, from_number: Optional[str] = None,
+                 api_base: Optional[str] = None, timeout: float = 10.0):
+        http_client = (_RebasedHttpClient(api_base, timeout=timeout) if api_base
+                       else TwilioHttpClient(timeout=timeout))
+        self.client = Client(account_sid, auth_token, http_client=http_client)
+        self.from_number = from_number
+
+    def send(self, phone_number: str, body: str, from_number: Optional[str] = None):
+        return self.client.messages.create(
+            from_=from_number or self.from_number,
+            to=f"whatsapp:{phone_number}",
+            body=body
+        )
+
+
+class ReplyDispatcher:
+    """Runs reply jobs on a fixed pool of worker threads.
+
+    Each phone number hashes to one worker, so a user's messages are handled
+    and answered in arrival order. Every worker has a bounded queue;
+    ``submit`` returns False instead of blocking when it is full.
+    """
+
+    def __init__(self, handler: Callable[[str, Any], Optional[str]], sender: TwilioSender,
+                 workers: int = 4, max_queue: int = 100):
+        self.handler = handler
+        self.sender = sender
+        self._queues = [queue.Queue(maxsize=max_queue) for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self.metrics = {
+            'enqueued': 0,
+            'rejected': 0,
+            'completed': 0,
+            'failed': 0,
+            'latency_total': 0.0,
+            'latency_max': 0.0
+        }
+        for n, q in enumerate(self._queues):
+            t = threading.Thread(target=self._run, args=(q,), name=f"reply-worker-{n}",
+                                 daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, phone_number: str, message: Any, from_number: Optional[str] = None) -> bool:
+        q = self._queues[zlib.crc32(phone_number.encode('utf-8')) % len(self._queues)]
+        try:
+            q.put_nowait((phone_number, message, from_number, time.monotonic()))
+        except queue.Full:
+            self._count('rejected')
+            logger.warning(f"Reply queue full, rejecting message from {phone_number}")
+            return False
+        self._count('enqueued')
+        return True
+
+    def _count(self, key: str, value=1):
+        with self._lock:
+            self.metrics[key] += value
+
+    def _run(self, q: queue.Queue):
+        while True:
+            job = q.get()
+            if job is None:
+                q.task_done()
+                return
+            phone_number, message, from_number, enqueued_at = job
+            try:
+                reply = self.handler(phone_number, message)
+                if reply:
+                    self.sender.send(phone_number, reply, from_number)
+                latency = time.monotonic() - enqueued_at
+                with self._lock:
+                    self.metrics['completed'] += 1
+                    self.metrics['latency_total'] += latency
+                    self.metrics['latency_max'] = max(self.metrics['latency_max'], latency)
+            except Exception as e:
+                self._count('failed')
+                logger.error(f"Reply delivery error for {phone_number}: {e}")
+            finally:
+                q.task_done()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.metrics)
+        stats['queue_depth'] = sum(q.qsize() for q in self._queues)
+        stats['latency_avg'] = (stats['latency_total'] / stats['completed']
+                                if stats['completed'] else 0.0)
+        return stats
+
+    def shutdown(self, timeout: float = 10.0):
+        """Let queued jobs finish, then stop the workers, within ``timeout`` seconds."""
+        deadline = time.monotonic() + timeout
+        for n, q in enumerate(self._queues):
+            try:
+                q.put(None, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                logger.warning(f"Reply worker {n} still busy at shutdown, abandoning its queue")
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
@@ -0,0 +1,89 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stubs import StubServer
+from llm_client import CircuitBreaker, LLMClient, LLMError, LLMRequestRejected, LLMUnavailable
+
+MESSAGES = [{'role': 'user', 'content': 'hello'}]
+
+
+class LLMClientTest(unittest.TestCase):
+    """Drives the LLM client against the local stub endpoint."""
+
+    def setUp(self):
+        self.stub = StubServer(llm_latency=0).__enter__()
+        self.addCleanup(self.stub.__exit__, None, None, None)
+
+    def client(self, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        return LLMClient(api_key='test', base_url=self.stub.url, **kwargs)
+
+    def test_retries_429_and_5xx(self):
+        self.stub.llm_statuses = [429, 503]
+        reply, usage = self.client(max_retries=2).complete_with_usage(MESSAGES)
+        self.assertEqual(reply, 'Stub answer to: hello')
+        self.assertIn('prompt_tokens', usage)
+        self.assertEqual(self.stub.requests, 3)
+
+    def test_gives_up_after_max_retries(self):
+        self.stub.llm_statuses = [500, 500, 500]
+        client = self.client(max_retries=1)
+        with self.assertRaises(LLMError):
+            client.complete(MESSAGES)
+        self.assertEqual(self.stub.requests, 2)
+        self.assertEqual(client.breaker.failures, 1)
+
+    def test_4xx_is_not_retried_or_counted_by_the_breaker(self):
+        client = self.client(breaker=CircuitBreaker(failure_threshold=2))
+        for status in (400, 401, 404):
+            self.stub.llm_statuses = [status]
+            with self.assertRaises(LLMRequestRejected):
+                client.complete(MESSAGES)
+        self.assertEqual(self.stub.requests, 3)
+        self.assertEqual(client.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(client.breaker.failures, 0)
+
+    def test_breaker_opens_and_half_opens(self):
+        client = self.client(max_retries=0,
+                             breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.2))
+        self.stub.llm_statuses = [503, 503]
+        for _ in range(2):
+            with self.assertRaises(LLMError):
+                client.complete(MESSAGES)
+        self.assertEqual(client.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(LLMUnavailable):
+            client.complete(MESSAGES)
+        self.assertEqual(self.stub.requests, 2)
+
+        # A failed trial call reopens the circuit at once
+        time.sleep(0.25)
+        self.stub.llm_statuses = [503]
+        with self.assertRaises(LLMError):
+            client.complete(MESSAGES)
+        self.assertEqual(client.breaker.state, CircuitBreaker.OPEN)
+
+        time.sleep(0.25)
+        self.assertEqual(client.complete(MESSAGES), 'Stub answer to: hello')
+        self.assertEqual(client.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.stub.requests, 4)
+
+    def test_concurrency_limit(self):
+        self.stub.llm_latency = 0.3
+        client = self.client(max_concurrency=1, acquire_timeout=0.05)
+        first = threading.Thread(target=client.complete, args=(MESSAGES,))
+        first.start()
+        time.sleep(0.1)
+        with self.assertRaises(LLMUnavailable):
+            client.complete(MESSAGES)
+        first.join()
+        self.assertEqual(self.stub.requests, 1)
+        self.assertEqual(client.complete(MESSAGES), 'Stub answer to: hello')
+
+
+if __name__ == '__main__':
+    unittest.main()
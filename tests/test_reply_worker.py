@@ -0,0 +1,77 @@
+import os
+import random
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stubs import StubServer
+from reply_worker import ReplyDispatcher, TwilioSender
+
+
+class ReplyDispatcherTest(unittest.TestCase):
+    """Drives the dispatcher and Twilio sender against the local stub endpoint."""
+
+    def setUp(self):
+        self.stub = StubServer().__enter__()
+        self.addCleanup(self.stub.__exit__, None, None, None)
+        self.sender = TwilioSender('AC' + '0' * 32, 'token', from_number='whatsapp:+15550000000',
+                                   api_base=self.stub.url)
+
+    def test_replies_keep_per_user_order(self):
+        def handler(phone_number, message):
+            time.sleep(random.uniform(0, 0.01))
+            return f"reply to {message}"
+
+        dispatcher = ReplyDispatcher(handler, self.sender, workers=3)
+        phones = [f"+1555000000{n}" for n in range(5)]
+        for i in range(8):
+            for phone in phones:
+                self.assertTrue(dispatcher.submit(phone, f"{phone} #{i}"))
+        dispatcher.shutdown()
+
+        for phone in phones:
+            bodies = [m['Body'] for m in self.stub.messages if m['To'] == f"whatsapp:{phone}"]
+            self.assertEqual(bodies, [f"reply to {phone} #{i}" for i in range(8)])
+        self.assertEqual(self.stub.messages[0]['From'], 'whatsapp:+15550000000')
+        stats = dispatcher.stats()
+        self.assertEqual((stats['completed'], stats['failed']), (40, 0))
+
+    def test_submit_rejects_when_queue_is_full(self):
+        started, release = threading.Event(), threading.Event()
+
+        def handler(phone_number, message):
+            started.set()
+            release.wait(5)
+            return f"reply to {message}"
+
+        dispatcher = ReplyDispatcher(handler, self.sender, workers=1, max_queue=1)
+        self.assertTrue(dispatcher.submit('+15550000001', 'first'))
+        self.assertTrue(started.wait(5))
+        self.assertTrue(dispatcher.submit('+15550000001', 'second'))
+        self.assertFalse(dispatcher.submit('+15550000002', 'third'))
+        self.assertEqual(dispatcher.stats()['rejected'], 1)
+
+        release.set()
+        dispatcher.shutdown()
+        self.assertEqual([m['Body'] for m in self.stub.messages],
+                         ['reply to first', 'reply to second'])
+
+    def test_shutdown_returns_within_timeout_when_queue_is_full(self):
+        release = threading.Event()
+        dispatcher = ReplyDispatcher(lambda phone, message: release.wait(5) and None,
+                                     self.sender, workers=1, max_queue=1)
+        dispatcher.submit('+15550000001', 'first')
+        time.sleep(0.05)
+        dispatcher.submit('+15550000001', 'second')
+
+        start = time.monotonic()
+        dispatcher.shutdown(timeout=0.2)
+        self.assertLess(time.monotonic() - start, 1.0)
+        release.set()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
+import threading
+import time
+import logging
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+
+class StaleProfileError(Exception):
+    """The profile changed in MongoDB since this copy was read.
+
+    The cached copy has been dropped; re-read the profile and redo whatever
+    decided the write, since it was based on stale state.
+    """
+
+
+class UserProfile(dict):
+    """A user document that remembers which fields changed since it was loaded."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._dirty = set()
+        self._removed = set()
+
+    @classmethod
+    def new(cls, data: Dict) -> 'UserProfile':
+        profile = cls()
+        profile.update(data)
+        return profile
+
+    def __setitem__(self, key, value):
+        if key not in self or self[key] != value:
+            self._dirty.add(key)
+            self._removed.discard(key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._dirty.discard(key)
+        self._removed.add(key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return super().pop(key, *default)
+
+    def changes(self) -> Tuple[Dict, Dict]:
+        """``($set, $unset)`` documents for the fields changed since loading."""
+        set_fields = {k: self[k] for k in self._dirty if k != '_id'}
+        unset_fields = {k: '' for k in self._removed}
+        return set_fields, unset_fields
+
+    def mark_clean(self):
+        self._dirty.clear()
+        self._removed.clear()
+
+    def copy(self) -> 'UserProfile':
+        clone = UserProfile(dict.copy(self))
+        clone._dirty = set(self._dirty)
+        clone._removed = set(self._removed)
+        return clone
+
+
+class ProfileCache:
+    """Per-process LRU+TTL cache in front of the users collection.
+
+    Writes go through the cache and only ``$set`` changed fields. Every write
+    also bumps a ``version`` field and is conditional on the version the
+    profile was read at; a write from a stale copy raises
+    ``StaleProfileError`` instead of overwriting newer data. Reads are
+    bounded by ``ttl``, or kept current across workers with
+    ``watch_changes``.
+    """
+
+    def __init__(self, collection, max_size: int = 10000, ttl: float = 60.0):
+        self.collection = collection
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale_writes = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def get(self, phone_number: str) -> Optional[UserProfile]:
+        with self._lock:
+            entry = self._entries.get(phone_number)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(phone_number)
+                self.hits += 1
+                return entry[0].copy()
+            self.misses += 1
+        doc = self.collection.find_one({'phone_number': phone_number})
+        if doc is None:
+            return None
+        profile = UserProfile(doc)
+        self._store(phone_number, profile)
+        return profile.copy()
+
+    def save(self, phone_number: str, profile: Dict):
+        """Persist the changed fields of ``profile``. Plain dicts are saved whole."""
+        if not isinstance(profile, UserProfile):
+            profile = UserProfile.new(profile)
+        set_fields, unset_fields = profile.changes()
+        if not set_fields and not unset_fields:
+            return None
+        if '_id' not in profile:
+            return self._upsert(phone_number, profile, set_fields)
+
+        update = {'$inc': {'version': 1}}
+        if set_fields:
+            update['$set'] = set_fields
+        if unset_fields:
+            update['$unset'] = unset_fields
+        result = self.collection.update_one(
+            {'_id': profile['_id'], 'version': profile.get('version')}, update)
+        if result.matched_count:
+            profile['version'] = (profile.get('version') or 0) + 1
+            profile.mark_clean()
+            self._store(phone_number, profile)
+            return result
+
+        # Another worker wrote since this copy was read. The changes were
+        # derived from stale state, so they cannot simply be reapplied.
+        with self._lock:
+            self.stale_writes += 1
+        self.invalidate(phone_number)
+        raise StaleProfileError(f"Profile for {phone_number} changed since it was read")
+
+    def _upsert(self, phone_number: str, profile: UserProfile, set_fields: Dict):
+        set_fields = {k: v for k, v in set_fields.items() if k != 'version'}
+        set_fields.pop('phone_number', None)
+        doc = self.collection.find_one_and_update(
+            {'phone_number': phone_number},
+            {'$set': set_fields, '$inc': {'version': 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        dict.update(profile, doc)
+        profile.mark_clean()
+        self._store(phone_number, profile)
+        return doc
+
+    def _store(self, phone_number: str, profile: UserProfile):
+        clean = UserProfile(dict.copy(profile))
+        with self._lock:
+            self._entries[phone_number] = (clean, time.monotonic() + self.ttl)
+            self._entries.move_to_end(phone_number)
+            if '_id' in clean:
+                self._ids[clean['_id']] = phone_number
+            while len(self._entries) > self.max_size:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._ids.pop(evicted.get('_id'), None)
+
+    def invalidate(self, phone_number: str):
+        with self._lock:
+            entry = self._entries.pop(phone_number, None)
+            if entry is not None:
+                self.invalidations += 1
+                self._ids.pop(entry[0].get('_id'), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._ids.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'stale_writes': self.stale_writes,
+                'invalidations': self.invalidations
+            }
+
+    def watch_changes(self) -> threading.Thread:
+        """Invalidate entries changed by other workers via a change stream.
+
+        Requires a replica set (as on Atlas). Runs on a daemon thread and
+        falls back to TTL expiry if the stream errors.
+        """
+        def run():
+            pipeline = [{'$match': {'operationType': {'$in': ['update', 'replace', 'delete']}}}]
+            try:
+                with self.collection.watch(pipeline) as stream:
+                    for change in stream:
+                        with self._lock:
+                            phone_number = self._ids.get(change['documentKey']['_id'])
+                        if phone_number is not None:
+                            self._invalidate_if_older(phone_number, change)
+            except Exception as e:
+                logger.error(f"User change stream stopped, relying on TTL: {e}")
+
+        thread = threading.Thread(target=run, name='user-cache-watch', daemon=True)
+        thread.start()
+        return thread
+
+    def _invalidate_if_older(self, phone_number: str, change: Dict):
+        # Our own writes also show up here; skip those the cache already has.
+        fields = change.get('updateDescription', {}).get('updatedFields', {})
+        with self._lock:
+            entry = self._entries.get(phone_number)
+            current = entry[0].get('version') if entry else None
+        if entry is None or fields.get('version') is None or fields['version'] > (current or 0):
+            self.invalidate(phone_number)
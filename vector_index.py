@@ -0,0 +1,295 @@
+from typing import List, Optional, Tuple
+from datetime import datetime
+import json
+import os
+import threading
+import time
+import logging
+
+import numpy as np
+from bson import ObjectId
+
+from quantization import DTYPES, to_format
+
+logger = logging.getLogger(__name__)
+
+
+class VectorIndex:
+    """Local index over the embeddings stored in a Mongo collection.
+
+    Vectors live in a contiguous memory-mapped matrix on disk, row ``i``
+    belonging to ``ids[i]``. ``sync`` appends documents inserted since the
+    last sync, so the index only re-reads the whole collection when
+    documents have been removed.
+
+    With ``fmt`` set to ``'float16'`` or ``'int8'`` rows are kept in that
+    compact form alongside a per-row scale, and scores are computed on it
+    directly.
+    """
+
+    def __init__(self, path: str, dim: int = 768, nlist: int = 0,
+                 nprobe: int = 8, sync_interval: float = 30.0, fmt: str = 'float32'):
+        self.path = path
+        self.dim = dim
+        self.fmt = fmt
+        self.dtype = DTYPES[fmt]
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.sync_interval = sync_interval
+        self.ids: List[str] = []
+        self.count = 0
+        self.last_id: Optional[str] = None
+        self.skipped = 0
+        self.updated_at: Optional[datetime] = None
+        self._capacity = 0
+        self._matrix: Optional[np.memmap] = None
+        self._scales: Optional[np.memmap] = None
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments: Optional[np.ndarray] = None
+        self._trained_count = 0
+        self._last_sync = 0.0
+        self._lock = threading.RLock()
+        self._load()
+
+    @property
+    def _vectors_path(self) -> str:
+        return f"{self.path}.{self.fmt}"
+
+    @property
+    def _scales_path(self) -> str:
+        return f"{self.path}.scale"
+
+    @property
+    def _meta_path(self) -> str:
+        return f"{self.path}.meta.json"
+
+    def _load(self):
+        if not (os.path.exists(self._meta_path) and os.path.exists(self._vectors_path)):
+            return
+        try:
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            if meta.get('dim') != self.dim or meta.get('fmt', 'float32') != self.fmt:
+                logger.warning(f"Index {self.path} does not match dim/format, ignoring it")
+                return
+            self.ids = meta['ids']
+            self.count = len(self.ids)
+            self.last_id = meta.get('last_id')
+            self.skipped = meta.get('skipped', 0)
+            if meta.get('updated_at'):
+                self.updated_at = datetime.fromisoformat(meta['updated_at'])
+            self._open(max(meta.get('capacity', self.count), 1))
+        except Exception as e:
+            logger.error(f"Index load error: {e}")
+            self._reset()
+
+    def _save_meta(self):
+        tmp = f"{self._meta_path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({
+                'dim': self.dim,
+                'fmt': self.fmt,
+                'capacity': self._capacity,
+                'last_id': self.last_id,
+                'skipped': self.skipped,
+                'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+                'ids': self.ids
+            }, f)
+        os.replace(tmp, self._meta_path)
+
+    def _open(self, capacity: int):
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._scales.flush()
+        self._matrix = _memmap(self._vectors_path, self.dtype, (capacity, self.dim))
+        self._scales = _memmap(self._scales_path, np.float32, (capacity,))
+        self._capacity = capacity
+
+    def _reset(self):
+        self.ids = []
+        self.count = 0
+        self.last_id = None
+        self.skipped = 0
+        self._matrix = None
+        self._scales = None
+        self._capacity = 0
+        self._centroids = None
+        self._assignments = None
+        self._trained_count = 0
+        for p in (self._vectors_path, self._scales_path, self._meta_path):
+            if os.path.exists(p):
+                os.remove(p)
+
+    def add(self, ids: List[str], vectors: np.ndarray, scales: Optional[np.ndarray] = None):
+        """Append rows already in the index format, scaled by ``scales``."""
+        vectors = np.asarray(vectors, dtype=self.dtype).reshape(-1, self.dim)
+        if scales is None:
+            scales = np.ones(len(vectors), dtype=np.float32)
+        if len(ids) != len(vectors):
+            raise ValueError("ids and vectors must have the same length")
+        with self._lock:
+            end = self.count + len(vectors)
+            if end > self._capacity:
+                self._open(max(end, self._capacity * 2, 1024))
+            self._matrix[self.count:end] = vectors
+            self._scales[self.count:end] = scales
+            self._matrix.flush()
+            self._scales.flush()
+            self.ids.extend(ids)
+            self.count = end
+            if ids:
+                self.last_id = ids[-1]
+            self._save_meta()
+            if self._centroids is not None:
+                if self.count >= 2 * self._trained_count:
+                    self._train()
+                else:
+                    decoded = vectors.astype(np.float32) * np.asarray(scales)[:, None]
+                    self._assignments = np.concatenate(
+                        [self._assignments, self._assign(decoded)])
+
+    def sync(self, collection, force: bool = False):
+        """Bring the index up to date with ``collection``.
+
+        Documents inserted since the last sync are appended. If documents
+        were re-encoded (``embedding_updated_at``, set by
+        ``migrate_embeddings``) or the indexed count no longer matches the
+        collection up to the last indexed ``_id``, as after a delete, the
+        index is rebuilt. Inserts racing the sync are picked up next time.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_sync < self.sync_interval:
+            return
+        with self._lock:
+            self._last_sync = now
+            if self._reencoded(collection):
+                logger.info(f"Embeddings re-encoded in collection, rebuilding {self.path}")
+                self._reset()
+            self._append_new(collection)
+            # Only up to last_id, so documents inserted after _append_new's
+            # read do not look like a mismatch
+            expected = 0
+            if self.last_id:
+                expected = collection.count_documents({
+                    'embedding': {'$exists': True},
+                    '_id': {'$lte': _to_id(self.last_id)}
+                })
+            if self.count + self.skipped != expected:
+                logger.info(f"Index has {self.count + self.skipped} of {expected} documents, "
+                            f"rebuilding {self.path}")
+                self._reset()
+                self._append_new(collection)
+            if self.nlist and self._centroids is None and self.count >= self.nlist * 39:
+                self._train()
+
+    def _reencoded(self, collection) -> bool:
+        latest = collection.find_one({'embedding_updated_at': {'$exists': True}},
+                                     {'embedding_updated_at': 1},
+                                     sort=[('embedding_updated_at', -1)])
+        if latest is None or (self.updated_at and latest['embedding_updated_at'] <= self.updated_at):
+            return False
+        self.updated_at = latest['embedding_updated_at']
+        return self.count > 0
+
+    def _append_new(self, collection):
+        query = {'embedding': {'$exists': True}}
+        if self.last_id:
+            query['_id'] = {'$gt': _to_id(self.last_id)}
+        projection = {'embedding': 1, 'embedding_format': 1, 'embedding_scale': 1}
+        cursor = collection.find(query, projection).sort('_id', 1)
+        batch_ids, batch_vecs, batch_scales = [], [], []
+        last_seen = None
+        for doc in cursor:
+            last_seen = str(doc['_id'])
+            values, scale = to_format(doc, self.fmt)
+            if len(values) != self.dim:
+                self.skipped += 1
+                continue
+            batch_ids.append(str(doc['_id']))
+            batch_vecs.append(values)
+            batch_scales.append(scale)
+            if len(batch_ids) >= 4096:
+                self.add(batch_ids, np.array(batch_vecs), np.array(batch_scales))
+                batch_ids, batch_vecs, batch_scales = [], [], []
+        if batch_ids:
+            self.add(batch_ids, np.array(batch_vecs), np.array(batch_scales))
+        if last_seen is not None:
+            # Also past skipped documents, so they are not re-read every sync
+            self.last_id = last_seen
+            self._save_meta()
+
+    def rebuild(self, collection):
+        with self._lock:
+            self._reset()
+            self.sync(collection, force=True)
+
+    def _train(self, iterations: int = 10):
+        """Cluster the stored vectors with k-means for approximate search."""
+        data = self._matrix[:self.count].astype(np.float32) * self._scales[:self.count, None]
+        rng = np.random.default_rng(0)
+        centroids = data[rng.choice(self.count, self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(data @ centroids.T, axis=1)
+            for c in range(self.nlist):
+                members = data[assignments == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+        self._centroids = centroids
+        self._assignments = np.argmax(data @ centroids.T, axis=1)
+        self._trained_count = self.count
+        logger.info(f"Trained {self.nlist} clusters over {self.count} vectors")
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self._centroids.T, axis=1)
+
+    def search(self, query: List[float], k: int = 5,
+               approximate: bool = False) -> List[Tuple[str, float]]:
+        """Return the ``k`` best ``(id, score)`` pairs by dot product."""
+        q = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            if self.count == 0:
+                return []
+            if approximate and self._centroids is not None:
+                probes = np.argsort(-(self._centroids @ q))[:self.nprobe]
+                rows = np.flatnonzero(np.isin(self._assignments, probes))
+                scores = self._score(q, rows)
+            else:
+                rows = None
+                scores = self._score(q)
+            k = min(k, len(scores))
+            if k == 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            if rows is not None:
+                return [(self.ids[rows[i]], float(scores[i])) for i in top]
+            return [(self.ids[i], float(scores[i])) for i in top]
+
+    def _score(self, q: np.ndarray, rows: Optional[np.ndarray] = None,
+               block: int = 16384) -> np.ndarray:
+        """Dot products of ``q`` with stored rows, upcasting one block at a time."""
+        if self.fmt == 'float32':
+            data = self._matrix[:self.count] if rows is None else self._matrix[rows]
+            scores = data @ q
+        else:
+            n = self.count if rows is None else len(rows)
+            scores = np.empty(n, dtype=np.float32)
+            for start in range(0, n, block):
+                sel = slice(start, min(start + block, n))
+                chunk = self._matrix[sel] if rows is None else self._matrix[rows[sel]]
+                scores[sel] = chunk.astype(np.float32) @ q
+        scales = self._scales[:self.count] if rows is None else self._scales[rows]
+        return scores * scales
+
+
+def _memmap(path: str, dtype, shape):
+    mode = 'r+' if os.path.exists(path) else 'w+'
+    needed = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    if mode == 'r+' and os.path.getsize(path) < needed:
+        with open(path, 'r+b') as f:
+            f.truncate(needed)
+    return np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+
+
+def _to_id(value: str):
+    return ObjectId(value) if ObjectId.is_valid(value) else value